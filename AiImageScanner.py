@@ -1,545 +1,2592 @@
-import tkinter as tk
-from tkinter import ttk, filedialog, scrolledtext, font
 import os
+import sys
+import argparse
 import shutil
 import base64
 import requests
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
+import hashlib
+import filecmp
+import sqlite3
+import struct
+import io
 import threading
-import sv_ttk
-import webbrowser
+import socket
+import weakref
+import queue
+import time
+import random
+import email.utils
+import errno
+import asyncio
+import mmap
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # --- Custom Exception for Quota Errors ---
 class QuotaExceededError(Exception):
     pass
+class ScanCancelledError(Exception):
+    pass
+_PROPAGATED_ERRORS = (QuotaExceededError, ScanCancelledError)
 
 # --- START OF CORE LOGIC FUNCTIONS ---
-def get_image_data(image_path):
+GOOGLE_MODEL_NAME = "gemini-1.5-flash-latest"
+GOOGLE_API_BASE = "https://generativelanguage.googleapis.com"
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".aiimagescanner", "verdicts.sqlite3")
+
+# --- Persistent verdict cache (content hash + provider settings -> verdict) ---
+class VerdictCache:
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_entries=500000):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pending_writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, content_hash TEXT, last_used REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, value INTEGER, last_used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files(last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts(last_used)")
+        self._conn.commit()
+    def content_hash(self, image_path):
+        # Fast path: an unchanged (path, size, mtime) is trusted without re-reading the file.
+        st = os.stat(image_path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, content_hash FROM files WHERE path=?", (image_path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns: return row[2]
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(1 << 20), b''): digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", (image_path, st.st_size, st.st_mtime_ns, content_hash, time.time()))
+            self._note_write()
+        return content_hash
+    def make_key(self, image_path, provider, model_name, prompt_mode, temperature, focus_keyword):
+        fields = [self.content_hash(image_path), provider, model_name, prompt_mode, temperature, _keyword_key(focus_keyword)]
+        return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM verdicts WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE verdicts SET last_used=? WHERE key=?", (time.time(), key))
+            self._note_write()
+            return row[0]
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)", (key, value, time.time()))
+            self._note_write()
+    def _note_write(self):
+        self._pending_writes += 1
+        if self._pending_writes >= 200:
+            self._conn.commit()
+            self._pending_writes = 0
+    def evict(self):
+        with self._lock:
+            for table in ('verdicts', 'files'):
+                count = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+            self._conn.commit()
+    def close(self):
+        self.evict()
+        with self._lock: self._conn.close()
+def open_verdict_cache(params, log_callback):
+    if not params.get('use_cache', True): return None
+    try:
+        return VerdictCache(params.get('cache_path') or DEFAULT_CACHE_PATH, params.get('cache_max_entries', 500000))
+    except (OSError, sqlite3.Error) as e:
+        log_callback(f"Warning: Result cache unavailable, continuing without it ({e}).")
+        return None
+def _cache_lookup(cache, image_path, fields, log_callback, lookup=True):
+    if cache is None or fields is None: return None, None
+    try:
+        key = cache.make_key(image_path, *fields)
+        return key, (cache.get(key) if lookup else None)
+    except (OSError, sqlite3.Error) as e:
+        log_callback(f"Warning: Cache lookup failed for {os.path.basename(image_path)}: {e}")
+        return None, None
+def _cache_store(cache, key, value):
+    if cache is None or key is None: return
+    try: cache.put(key, value)
+    except sqlite3.Error: pass
+def _ollama_cache_mode(mode, prompt_mode, focus_keyword=None, threshold=None):
+    # Multi-keyword verdicts are stored with the threshold already applied, so it is part of the key.
+    if _is_multi(focus_keyword): return f"multi/confidence>={threshold}" if mode == 'confidence' else "multi/yesno"
+    return mode if mode == 'confidence' else f"{mode}/{prompt_mode}"
+def _verdict_result(image_path, value, threshold=None, focus_keyword=None):
+    if _is_multi(focus_keyword):
+        keywords = [keyword for index, keyword in enumerate(focus_keyword) if value >> index & 1]
+        return KeywordMatch(image_path, keywords) if keywords else None
+    matched = value >= threshold if threshold is not None else bool(value)
+    return image_path if matched else None
+
+# --- Multi-keyword classification: one request answers every keyword as JSON, verdicts are keyword bitmasks ---
+class KeywordMatch(str):
+    # A matched path that also carries the keywords it matched; everywhere else it is just the path.
+    def __new__(cls, image_path, keywords):
+        match = super().__new__(cls, image_path)
+        match.keywords = keywords
+        return match
+def _is_multi(focus_keyword):
+    return isinstance(focus_keyword, (list, tuple))
+def _keyword_key(focus_keyword):
+    return "|".join(keyword.strip().lower() for keyword in focus_keyword) if _is_multi(focus_keyword) else focus_keyword.strip().lower()
+def _keyword_label(focus_keyword):
+    return ", ".join(focus_keyword) if _is_multi(focus_keyword) else focus_keyword
+def _keyword_folders(result_path):
+    if not isinstance(result_path, KeywordMatch): return None
+    return [re.sub(r'[\\/:*?"<>|]+', '_', keyword).strip(' .') or 'keyword' for keyword in result_path.keywords]
+def _multi_prompt(keywords, scored):
+    listed = ", ".join(f"'{keyword}'" for keyword in keywords)
+    example = json.dumps({keyword: (7 if scored else True) if index == 0 else (1 if scored else False) for index, keyword in enumerate(keywords)})
+    if scored:
+        return f"You are an expert image analyst. For each of these subjects: {listed}, rate from 1 to 10 how confident you are that it is the main subject of this image (1 = not at all, 10 = absolutely certain). Respond only with a JSON object that maps every subject to its score, for example {example}."
+    return f"You are an expert image analyst. For each of these subjects: {listed}, decide whether it is the main subject of this image. Respond only with a JSON object that maps every subject to true or false, for example {example}."
+def _multi_verdict(response_text, keywords, threshold=None):
+    match = re.search(r'\{.*\}', response_text, re.S)
+    if not match: raise ValueError(f"Expected a JSON object, got: {response_text[:80]!r}")
+    answers = {str(key).strip().lower(): value for key, value in json.loads(match.group(0)).items()}
+    mask = 0
+    for index, keyword in enumerate(keywords):
+        value = answers.get(keyword.strip().lower())
+        if isinstance(value, str): value = {'yes': True, 'true': True, 'no': False, 'false': False}.get(value.strip().lower(), value)
+        try:
+            matched = float(value) >= threshold if threshold is not None else value is True
+        except (TypeError, ValueError):
+            matched = False
+        if matched: mask |= 1 << index
+    return mask
+
+# --- Image preprocessing (embedded RAW previews, downscale, re-encode) ---
+RAW_PREVIEW_EXTENSIONS = ('.cr2', '.dng', '.tiff')
+def _format_bytes(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024 or unit == 'GB': return f"{num_bytes:.1f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+def _tiff_values(raw_file, endian, field_type, count, value):
+    fmt = {3: 'H', 4: 'I', 13: 'I'}.get(field_type)
+    if not fmt: return []
+    size = struct.calcsize(fmt) * count
+    if size <= 4:
+        data = value[:size]
+    else:
+        raw_file.seek(struct.unpack(endian + 'I', value)[0])
+        data = raw_file.read(size)
+        if len(data) < size: return []
+    return list(struct.unpack(f"{endian}{count}{fmt}", data))
+def _jpeg_is_decodable(head):
+    # Baseline/extended/progressive JPEGs only; lossless (SOF3) RAW data cannot be decoded by Pillow.
+    if head[:2] != b'\xff\xd8': return False
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF: return False
+        marker = head[pos + 1]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC): return marker in (0xC0, 0xC1, 0xC2)
+        pos += 2 + struct.unpack('>H', head[pos + 2:pos + 4])[0]
+    return False
+def extract_embedded_preview(image_path):
+    with open(image_path, "rb") as raw_file:
+        header = raw_file.read(8)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'): return None
+        endian = '<' if header[:2] == b'II' else '>'
+        if struct.unpack(endian + 'H', header[2:4])[0] != 42: return None
+        candidates = []
+        pending, seen = [struct.unpack(endian + 'I', header[4:8])[0]], set()
+        while pending and len(seen) < 64:
+            offset = pending.pop()
+            if not offset or offset in seen: continue
+            seen.add(offset)
+            raw_file.seek(offset)
+            count_bytes = raw_file.read(2)
+            if len(count_bytes) < 2: continue
+            count = struct.unpack(endian + 'H', count_bytes)[0]
+            entries = raw_file.read(count * 12)
+            next_bytes = raw_file.read(4)
+            tags = {}
+            for i in range(len(entries) // 12):
+                tag, field_type, field_count, value = struct.unpack(endian + 'HHI4s', entries[i * 12:i * 12 + 12])
+                tags[tag] = (field_type, field_count, value)
+            values = lambda tag: _tiff_values(raw_file, endian, *tags[tag]) if tag in tags else []
+            jpeg_offset, jpeg_length = values(513), values(514)
+            if jpeg_offset and jpeg_length: candidates.append((jpeg_length[0], jpeg_offset[0]))
+            strip_offsets, strip_counts = values(273), values(279)
+            if values(259)[:1] in ([6], [7]) and len(strip_offsets) == 1 and len(strip_counts) == 1:
+                candidates.append((strip_counts[0], strip_offsets[0]))
+            pending.extend(values(330))
+            if len(next_bytes) == 4: pending.append(struct.unpack(endian + 'I', next_bytes)[0])
+        for length, offset in sorted(candidates, reverse=True):
+            raw_file.seek(offset)
+            if not _jpeg_is_decodable(raw_file.read(min(length, 131072))): continue
+            raw_file.seek(offset)
+            return raw_file.read(length)
+    return None
+class ImagePreprocessor:
+    def __init__(self, max_edge=1536, quality=85, output_format='jpeg', use_raw_previews=True, metrics=None):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.output_format = 'WEBP' if output_format.lower() == 'webp' else 'JPEG'
+        self.mime_type = 'image/webp' if self.output_format == 'WEBP' else 'image/jpeg'
+        self.use_raw_previews = use_raw_previews
+        self.metrics = metrics
+        self.images = 0
+        self.previews_used = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self._lock = threading.Lock()
+    def prepare(self, image_path):
+        started = time.monotonic()
+        original_size = os.path.getsize(image_path)
+        source, used_preview = image_path, False
+        if self.use_raw_previews and image_path.lower().endswith(RAW_PREVIEW_EXTENSIONS):
+            preview = extract_embedded_preview(image_path)
+            if preview:
+                source, used_preview = io.BytesIO(preview), True
+        try:
+            with Image.open(source) as img:
+                source_format = img.format
+                is_web_ready = not used_preview and source_format in ('JPEG', 'PNG', 'WEBP') and max(img.size) <= self.max_edge
+                img.draft('RGB', (self.max_edge, self.max_edge))
+                # Decoding is forced here so 'read' covers file I/O and decode, 'preprocess' the resize and re-encode.
+                img.load()
+                decoded = time.monotonic()
+                img = ImageOps.exif_transpose(img)
+                if img.mode != 'RGB': img = img.convert('RGB')
+                img.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS, reducing_gap=3.0)
+                buffer = io.BytesIO()
+                img.save(buffer, format=self.output_format, quality=self.quality)
+        except Exception:
+            return None
+        data, mime_type = buffer.getvalue(), self.mime_type
+        if is_web_ready and len(data) >= original_size:
+            # Small web images gain nothing from re-encoding; None means the original file is uploaded as is.
+            data, mime_type = None, Image.MIME[source_format]
+        if self.metrics is not None:
+            self.metrics.observe('read', decoded - started)
+            self.metrics.observe('preprocess', time.monotonic() - decoded)
+        with self._lock:
+            self.images += 1
+            self.previews_used += used_preview
+            self.bytes_before += original_size
+            self.bytes_after += original_size if data is None else len(data)
+        return data, mime_type
+    def summary(self):
+        change = (self.bytes_after / self.bytes_before - 1) * 100 if self.bytes_before else 0
+        return f"Preprocessing: {self.images} images ({self.previews_used} from embedded RAW previews), {_format_bytes(self.bytes_before)} -> {_format_bytes(self.bytes_after)} uploaded ({change:+.0f}%)."
+def create_preprocessor(params, log_callback, metrics=None):
+    if not params.get('preprocess', True): return None
+    if Image is None:
+        log_callback("Warning: Pillow is not installed, images will be uploaded unmodified.")
+        return None
+    return ImagePreprocessor(params.get('max_edge', 1536), params.get('upload_quality', 85), params.get('upload_format', 'jpeg'), params.get('raw_previews', True), metrics)
+
+# --- Streaming request bodies: base64 is produced chunk by chunk from an mmap while the request is sent ---
+STREAM_CHUNK_SIZE = 3 * 64 * 1024
+class EncodedImage:
+    # Stands in for the base64 string of an image; len() is the encoded length, the text itself only exists in chunks on the wire.
+    def __init__(self, path=None, data=None, prefix="", size=None, read_timer=None):
+        self.path = path
+        self.data = data
+        self.prefix = prefix
+        self.size = size if size is not None else len(data) if data is not None else os.path.getsize(path)
+        # [metrics] while the file's first read from disk is still to be timed; shared with prefixed copies so it is timed once.
+        self.read_timer = read_timer if read_timer is not None else [None]
+    def __len__(self):
+        return len(self.prefix) + 4 * ((self.size + 2) // 3)
+    def with_prefix(self, prefix):
+        return EncodedImage(self.path, self.data, prefix, self.size, self.read_timer)
+    def chunks(self, chunk_size=STREAM_CHUNK_SIZE):
+        if self.prefix: yield self.prefix.encode('ascii')
+        if self.data is not None:
+            view = memoryview(self.data)
+            for start in range(0, self.size, chunk_size): yield base64.b64encode(view[start:start + chunk_size])
+            return
+        if not self.size: return
+        metrics, self.read_timer[0] = self.read_timer[0], None
+        reading = 0.0
+        with open(self.path, "rb") as image_file, mmap.mmap(image_file.fileno(), self.size, access=mmap.ACCESS_READ) as mapped:
+            for start in range(0, self.size, chunk_size):
+                # An unprocessed file is only read while it is sent; the page-ins are timed as its 'read' stage.
+                started = time.monotonic()
+                chunk = mapped[start:start + chunk_size]
+                reading += time.monotonic() - started
+                yield base64.b64encode(chunk)
+        if metrics is not None: metrics.observe('read', reading)
+    def __str__(self):
+        return b"".join(self.chunks()).decode('ascii')
+def _data_url(mime_type, base64_image):
+    prefix = f"data:{mime_type};base64,"
+    return base64_image.with_prefix(prefix) if isinstance(base64_image, EncodedImage) else prefix + base64_image
+class StreamingJSONBody:
+    # Serializes everything but the images up front; iterating yields the JSON with each image spliced in, so retries can re-send it.
+    def __init__(self, payload):
+        images = []
+        def placeholder(value):
+            if not isinstance(value, EncodedImage): raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+            images.append(value)
+            return f"\0{len(images) - 1}\0"
+        text = json.dumps(payload, default=placeholder)
+        self.parts = [images[int(segment)] if index % 2 else segment.encode('utf-8') for index, segment in enumerate(re.split(r'"\\u0000(\d+)\\u0000"', text))]
+        self.length = sum(len(part) + 2 if isinstance(part, EncodedImage) else len(part) for part in self.parts)
+        self.sent_at = None
+    def __len__(self):
+        return self.length
+    def __iter__(self):
+        for part in self.parts:
+            if not isinstance(part, EncodedImage):
+                if part: yield part
+                continue
+            yield b'"'
+            yield from part.chunks()
+            yield b'"'
+        self.sent_at = time.monotonic()
+def _streaming_kwargs(kwargs):
+    # requests sends an iterable body with a known len() under a plain Content-Length, without buffering it.
+    body = StreamingJSONBody(kwargs.pop('json'))
+    return dict(kwargs, data=body, headers=dict(kwargs.get('headers') or {}, **{'Content-Type': 'application/json'}))
+async def _async_body(body):
+    for chunk in body: yield chunk
+
+def get_image_data(image_path, preprocessor=None, metrics=None):
     ext_to_mimetype = {'.png':'image/png', '.jpg':'image/jpeg', '.jpeg':'image/jpeg', '.webp':'image/webp', '.cr2':'image/x-canon-cr2', '.dng':'image/x-adobe-dng', '.tiff':'image/tiff'}
     file_ext = os.path.splitext(image_path.lower())[1]
     mime_type = ext_to_mimetype.get(file_ext)
     if not mime_type: return None, None
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-    return base64_image, mime_type
-def process_with_google(image_path, focus_keyword, api_key, debug_mode, log_callback):
+    if preprocessor is not None:
+        metrics = metrics or preprocessor.metrics
+        prepared = preprocessor.prepare(image_path)
+        # The preprocessor already timed the read, also when it keeps the original file for upload.
+        if prepared: return EncodedImage(image_path, prepared[0]), prepared[1]
+    return EncodedImage(image_path, read_timer=[metrics]), mime_type
+# --- Scan metrics: per-stage timings and request counters, summarized as percentiles and exported as JSON / Prometheus text ---
+METRIC_STAGES = ('load', 'read', 'preprocess', 'send', 'model', 'receive', 'parse', 'total')
+METRIC_QUANTILES = (50, 90, 95, 99)
+class ScanMetrics:
+    def __init__(self, max_samples=100000):
+        self.max_samples = max_samples
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}
+        self.requests = {}
+        self.images = {}
+        self._lock = threading.Lock()
+    def observe(self, stage, seconds):
+        seconds = max(0.0, seconds)
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'count': 0, 'sum': 0.0, 'max': 0.0, 'samples': []})
+            entry['count'] += 1
+            entry['sum'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            # Reservoir sampling keeps the percentiles representative with bounded memory on very large scans.
+            if len(entry['samples']) < self.max_samples: entry['samples'].append(seconds)
+            else:
+                slot = random.randrange(entry['count'])
+                if slot < self.max_samples: entry['samples'][slot] = seconds
+    def observe_request(self, provider, status, started, sent_at=None, headers_at=None, finished=None, retry=False, bytes_sent=0):
+        if sent_at is not None: self.observe('send', sent_at - started)
+        if headers_at is not None: self.observe('model', headers_at - (sent_at or started))
+        if headers_at is not None and finished is not None: self.observe('receive', finished - headers_at)
+        with self._lock:
+            entry = self.requests.setdefault(provider, {'status': {}, 'retries': 0, 'bytes_uploaded': 0})
+            entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+            entry['retries'] += retry
+            entry['bytes_uploaded'] += bytes_sent
+    def count_image(self, outcome):
+        with self._lock: self.images[outcome] = self.images.get(outcome, 0) + 1
+    def report(self):
+        with self._lock:
+            stages = {stage: (entry['count'], entry['sum'], entry['max'], sorted(entry['samples'])) for stage, entry in self.stages.items()}
+            requests_by_provider = json.loads(json.dumps(self.requests))
+            images = dict(self.images)
+        duration = (self.finished or time.time()) - self.started
+        processed = sum(images.values())
+        report = {"started": time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)), "duration_seconds": round(duration, 3), "images": dict(images, total=processed), "images_per_second": round(processed / duration, 3) if duration > 0 else 0.0, "stages": {}, "requests": requests_by_provider}
+        for stage in sorted(stages, key=lambda name: METRIC_STAGES.index(name) if name in METRIC_STAGES else len(METRIC_STAGES)):
+            count, total, peak, samples = stages[stage]
+            report["stages"][stage] = dict({"count": count, "sum": round(total, 6), "mean": round(total / count, 6), "max": round(peak, 6)}, **{f"p{q}": round(samples[max(0, -(-len(samples) * q // 100) - 1)], 6) for q in METRIC_QUANTILES})
+        return report
+    def prometheus_text(self, prefix="aiimagescanner"):
+        report = self.report()
+        lines = [f"# HELP {prefix}_stage_seconds Time an image or request spent in each scan stage.", f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, stats in report["stages"].items():
+            for q in METRIC_QUANTILES: lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q / 100}"}} {stats[f"p{q}"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines += [f"# HELP {prefix}_requests_total Provider HTTP requests by status code.", f"# TYPE {prefix}_requests_total counter"]
+        for provider, entry in report["requests"].items():
+            for status, count in entry["status"].items(): lines.append(f'{prefix}_requests_total{{provider="{provider}",status="{status}"}} {count}')
+        for name, key, text in (("retries_total", "retries", "Requests re-sent after a throttled, failed or timed-out attempt."), ("uploaded_bytes_total", "bytes_uploaded", "Request body bytes sent to the provider.")):
+            lines += [f"# HELP {prefix}_{name} {text}", f"# TYPE {prefix}_{name} counter"]
+            for provider, entry in report["requests"].items(): lines.append(f'{prefix}_{name}{{provider="{provider}"}} {entry[key]}')
+        lines += [f"# HELP {prefix}_images_total Images processed by outcome.", f"# TYPE {prefix}_images_total counter"]
+        for outcome, count in report["images"].items():
+            if outcome != "total": lines.append(f'{prefix}_images_total{{result="{outcome}"}} {count}')
+        lines += [f"# HELP {prefix}_scan_duration_seconds Wall time of the scan so far.", f"# TYPE {prefix}_scan_duration_seconds gauge", f"{prefix}_scan_duration_seconds {report['duration_seconds']}"]
+        lines += [f"# HELP {prefix}_images_per_second Average scan throughput.", f"# TYPE {prefix}_images_per_second gauge", f"{prefix}_images_per_second {report['images_per_second']}"]
+        return "\n".join(lines) + "\n"
+    def summary(self):
+        report = self.report()
+        if not report["stages"]: return []
+        timings = ", ".join(f"{stage} {stats['p50'] * 1000:.0f}/{stats['p95'] * 1000:.0f}/{stats['p99'] * 1000:.0f}" for stage, stats in report["stages"].items())
+        lines = [f"Timings in ms (p50/p95/p99): {timings}; {report['images_per_second']:.1f} images/s."]
+        for provider, entry in report["requests"].items():
+            statuses = ", ".join(f"{count}x {status}" for status, count in sorted(entry["status"].items()))
+            lines.append(f"Requests ({provider}): {statuses}; {entry['retries']} retries, {_format_bytes(entry['bytes_uploaded'])} uploaded.")
+        return lines
+def create_scan_metrics(params):
+    return ScanMetrics() if params.get('metrics', True) else None
+def _observe_since(session, stage, started):
+    metrics = getattr(session, 'metrics', None)
+    if metrics is not None: metrics.observe(stage, time.monotonic() - started)
+def _write_atomically(path, text):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as handle: handle.write(text)
+    os.replace(temp_path, path)
+def export_scan_metrics(metrics, params, log_callback, quiet=False):
+    for key, render in (('metrics_path', lambda: json.dumps(metrics.report(), indent=2)), ('prometheus_path', metrics.prometheus_text)):
+        path = params.get(key)
+        if not path: continue
+        try:
+            _write_atomically(path, render())
+            if not quiet: log_callback(f"Metrics written to {path}.")
+        except OSError as e:
+            log_callback(f"Warning: Could not write metrics to {path}: {e}")
+# --- Adaptive (AIMD) concurrency limiter with Retry-After and optional RPM/TPM budgets ---
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+class AdaptiveLimiter:
+    def __init__(self, name, initial=4, minimum=1, maximum=16, latency_tolerance=2.0, requests_per_minute=None, tokens_per_minute=None, tokens_per_request=1000):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.tokens_per_request = tokens_per_request
+        self.in_flight = 0
+        self.throttled = 0
+        self.peak_limit = self.limit
+        self._latency_floor = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._budgets = {}
+        if requests_per_minute: self._budgets['requests'] = [float(requests_per_minute), float(requests_per_minute), time.monotonic()]
+        if tokens_per_minute: self._budgets['tokens'] = [float(tokens_per_minute), float(tokens_per_minute), time.monotonic()]
+        self._cond = threading.Condition()
+    def _budget_wait(self, now):
+        wait = 0.0
+        for kind, budget in self._budgets.items():
+            capacity, level, updated = budget
+            level = min(capacity, level + (now - updated) * capacity / 60.0)
+            budget[1], budget[2] = level, now
+            needed = 1 if kind == 'requests' else self.tokens_per_request
+            if level < needed: wait = max(wait, (needed - level) * 60.0 / capacity)
+        return wait
+    def try_acquire(self):
+        # Returns 0 once a slot is taken, otherwise a hint (seconds) of how long to wait before retrying.
+        with self._cond:
+            now = time.monotonic()
+            if now < self._paused_until: return self._paused_until - now
+            if self.in_flight >= int(self.limit): return 0.05
+            wait = self._budget_wait(now)
+            if wait: return wait
+            for kind, budget in self._budgets.items(): budget[1] -= 1 if kind == 'requests' else self.tokens_per_request
+            self.in_flight += 1
+            return 0
+    def acquire(self, cancel_event=None):
+        while True:
+            if cancel_event is not None and cancel_event.is_set(): raise ScanCancelledError()
+            wait = self.try_acquire()
+            if not wait: return
+            with self._cond: self._cond.wait(min(wait, 0.25 if cancel_event is not None else 1.0))
+    def release(self, latency=None, throttled=False, failed=False):
+        # latency=None frees the slot without a sample: cancelled or failed attempts say nothing about healthy round trips.
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or failed:
+                self.throttled += throttled
+                # Multiplicative decrease, at most once per observed round trip so a burst of 429s counts once.
+                if now - self._last_decrease > (self._latency_floor or 1.0):
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            elif latency is not None:
+                self._latency_floor = latency if self._latency_floor is None else min(latency, self._latency_floor * 1.01)
+                if latency <= self._latency_floor * self.latency_tolerance:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                    self.peak_limit = max(self.peak_limit, self.limit)
+            self._cond.notify_all()
+    def record_usage(self, tokens):
+        # Each request reserved the running estimate; the provider's reported usage settles the difference and steers the next estimates.
+        with self._cond:
+            budget = self._budgets.get('tokens')
+            if budget is not None: budget[1] -= tokens - self.tokens_per_request
+            self.tokens_per_request = 0.8 * self.tokens_per_request + 0.2 * tokens
+            self._cond.notify_all()
+    def pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    def summary(self):
+        return f"Concurrency ({self.name}): settled at {int(self.limit)}, peak {int(self.peak_limit)}, {self.throttled} throttled responses."
+def _record_usage(limiter, result):
+    # OpenAI-compatible answers report 'usage', Gemini answers 'usageMetadata'.
+    if limiter is None or not isinstance(result, dict): return
+    usage = result.get('usage') or {}
+    tokens = usage.get('total_tokens') or (usage.get('prompt_tokens') or 0) + (usage.get('completion_tokens') or 0)
+    if not tokens:
+        usage = result.get('usageMetadata') or {}
+        tokens = usage.get('totalTokenCount') or (usage.get('promptTokenCount') or 0) + (usage.get('candidatesTokenCount') or 0)
+    if tokens: limiter.record_usage(tokens)
+def create_limiter(params, provider_name, max_workers):
+    return AdaptiveLimiter(provider_name, params.get('initial_concurrency', min(4, max_workers)), params.get('min_concurrency', 1), max_workers, params.get('latency_tolerance', 2.0), params.get('requests_per_minute'), params.get('tokens_per_minute'), params.get('tokens_per_request', 1000))
+def _parse_retry_after(value):
+    if not value: return None
     try:
-        base64_image, mime_type = get_image_data(image_path)
-        if not base64_image: return None
-    except IOError as e:
-        log_callback(f"Error reading file {os.path.basename(image_path)}: {e}")
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+def _retry_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    if retry_after is not None: return retry_after + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+def post_with_retry(http, url, limiter, log_callback, label, max_retries=5, retry_timeouts=True, **kwargs):
+    cancel_event = getattr(http, 'cancel_event', None) or threading.Event()
+    if 'json' in kwargs: kwargs = _streaming_kwargs(kwargs)
+    metrics = getattr(http, 'metrics', None)
+    body = kwargs.get('data') if isinstance(kwargs.get('data'), StreamingJSONBody) else None
+    for attempt in range(max_retries + 1):
+        if limiter is not None: limiter.acquire(cancel_event)
+        if cancel_event.is_set():
+            if limiter is not None: limiter.release()
+            raise ScanCancelledError()
+        started = time.monotonic()
+        if body is not None: body.sent_at = None
+        try:
+            response = http.post(url, **kwargs)
+        except requests.exceptions.Timeout:
+            if metrics is not None: metrics.observe_request(label, 'timeout', started, retry=attempt > 0)
+            if limiter is not None: limiter.release(throttled=not cancel_event.is_set())
+            _raise_if_cancelled(http)
+            # Behind an endpoint pool a timeout is the pool's to fail over; 429/5xx answers are still retried here.
+            if attempt == max_retries or not retry_timeouts: raise
+            delay = _retry_delay(attempt)
+            log_callback(f"Warning ({label}): Request timed out, retrying in {delay:.1f}s.")
+            if cancel_event.wait(delay): raise ScanCancelledError()
+            continue
+        except Exception as e:
+            if metrics is not None and not cancel_event.is_set(): metrics.observe_request(label, 'error', started, retry=attempt > 0)
+            if limiter is not None: limiter.release(failed=isinstance(e, requests.exceptions.ConnectionError) and not cancel_event.is_set())
+            _raise_if_cancelled(http)
+            raise
+        if metrics is not None:
+            # Streamed responses are still being generated when post() returns; their callers time the rest.
+            sent_at = getattr(body, 'sent_at', None)
+            metrics.observe_request(label, response.status_code, started, sent_at, started + response.elapsed.total_seconds(), None if kwargs.get('stream') else time.monotonic(), attempt > 0, len(body) if sent_at is not None else 0)
+        throttled = response.status_code in RETRYABLE_STATUS_CODES
+        # Error answers (often instant rejections) would drag the latency floor down, so only successes are sampled.
+        if limiter is not None: limiter.release(time.monotonic() - started if response.status_code < 400 else None, throttled)
+        if not throttled: return response
+        retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None and limiter is not None: limiter.pause(retry_after)
+        if attempt == max_retries:
+            if response.status_code == 429: raise QuotaExceededError(f"{label} quota still exhausted after {max_retries} retries")
+            return response
+        delay = _retry_delay(attempt, retry_after)
+        log_callback(f"Warning ({label}): Status {response.status_code}, retrying in {delay:.1f}s.")
+        if cancel_event.wait(delay): raise ScanCancelledError()
+
+# --- Near-duplicate clustering: dHash + multi-index Hamming lookup, one model call per cluster ---
+def perceptual_hash(image_path, hash_size=8):
+    source = image_path
+    if image_path.lower().endswith(RAW_PREVIEW_EXTENSIONS):
+        preview = extract_embedded_preview(image_path)
+        if preview: source = io.BytesIO(preview)
+    with Image.open(source) as img:
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        img = ImageOps.exif_transpose(img).convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = np.asarray(img, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+class DuplicateClusters:
+    def __init__(self, max_distance=5, hash_bits=64):
+        # Pigeonhole: two hashes within max_distance bits agree exactly on at least one of max_distance + 1 bands.
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        bounds = [(i * hash_bits // band_count, (i + 1) * hash_bits // band_count) for i in range(band_count)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in bounds]
+        self._tables = [{} for _ in self._bands]
+        self._hashes = {}
+        self._followers = {}
+        self._verdicts = {}
+        self._lock = threading.Lock()
+        self.clusters = 0
+        self.duplicates = 0
+    def assign(self, image_path, image_hash):
+        # Returns (representative, verdict_known, verdict); representative is None when image_path starts a new cluster.
+        keys = [(image_hash >> start) & mask for start, mask in self._bands]
+        with self._lock:
+            for table, key in zip(self._tables, keys):
+                for representative in table.get(key, ()):
+                    if (self._hashes[representative] ^ image_hash).bit_count() > self.max_distance: continue
+                    self.duplicates += 1
+                    if representative in self._verdicts: return representative, True, self._verdicts[representative]
+                    self._followers.setdefault(representative, []).append(image_path)
+                    return representative, False, None
+            self._hashes[image_path] = image_hash
+            for table, key in zip(self._tables, keys): table.setdefault(key, []).append(image_path)
+            self.clusters += 1
+            return None, False, None
+    def resolve(self, image_path, result):
+        with self._lock:
+            if image_path not in self._hashes: return []
+            self._verdicts[image_path] = result
+            return self._followers.pop(image_path, [])
+    def summary(self):
+        return f"Near-duplicates: {self.clusters} clusters, {self.duplicates} images took their representative's verdict ({self.duplicates} model calls saved)."
+def create_duplicate_clusters(params, log_callback):
+    if not params.get('dedupe', False): return None
+    if Image is None or np is None:
+        log_callback("Warning: Near-duplicate grouping needs Pillow and NumPy, continuing without it.")
         return None
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={api_key}"
+    return DuplicateClusters(params.get('dedupe_distance', 5))
+def _copy_verdict(result, image_path):
+    if result in ("FAILED", None): return result
+    if isinstance(result, KeywordMatch): return KeywordMatch(image_path, result.keywords)
+    return image_path
+
+# --- Provider request builders and response parsers (shared by the thread and asyncio engines) ---
+OLLAMA_BASE_URL = "http://localhost:11434"
+class AbortableHTTPAdapter(requests.adapters.HTTPAdapter):
+    # Tracks every connection this adapter opens so a stop can shut their sockets and unblock waiting workers.
+    def __init__(self, *args, **kwargs):
+        self._connections = weakref.WeakSet()
+        super().__init__(*args, **kwargs)
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        connections = self._connections
+        def tracked_pool(pool_class):
+            class TrackedConnection(pool_class.ConnectionCls):
+                def connect(self):
+                    super().connect()
+                    connections.add(self)
+                def request(self, *args, **kwargs):
+                    # The thread sending on this connection, so one request can be aborted without touching the rest.
+                    self.owner = threading.get_ident()
+                    return super().request(*args, **kwargs)
+            return type(f"Tracked{pool_class.__name__}", (pool_class,), {'ConnectionCls': TrackedConnection})
+        self.poolmanager.pool_classes_by_scheme = {scheme: tracked_pool(pool_class) for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()}
+    def abort(self, thread=None):
+        for connection in list(self._connections):
+            if thread is not None and getattr(connection, 'owner', None) != thread: continue
+            sock = getattr(connection, 'sock', None)
+            if sock is None: continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+def create_http_session(pool_size=4, metrics=None):
+    session = requests.Session()
+    session.metrics = metrics
+    adapter = AbortableHTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.cancel_event = threading.Event()
+    session.image_errors = set()
+    return session
+def abort_http_session(session, thread=None):
+    # Without a thread the whole session stops; with one, only the request that thread has on the wire is cut.
+    if thread is None: session.cancel_event.set()
+    for adapter in set(session.adapters.values()):
+        if isinstance(adapter, AbortableHTTPAdapter): adapter.abort(thread)
+def _note_image_error(session, image_path):
+    # Images that ended without a verdict; a delta scan must not treat them as seen.
+    errors = getattr(session, 'image_errors', None)
+    if errors is not None: errors.add(image_path)
+def _raise_if_cancelled(session):
+    cancel_event = getattr(session, 'cancel_event', None)
+    if cancel_event is not None and cancel_event.is_set(): raise ScanCancelledError()
+def _google_request(focus_keyword, api_key, base64_image, mime_type, api_base=GOOGLE_API_BASE):
+    api_url = f"{api_base}/v1beta/models/{GOOGLE_MODEL_NAME}:generateContent?key={api_key}"
     prompt = f"You are an image analyst. Your task is to determine if '{focus_keyword}' is the main subject. Answer only 'yes' or 'no'."
+    if _is_multi(focus_keyword): prompt = _multi_prompt(focus_keyword, scored=False)
     payload = {"contents": [{"parts": [{"text": prompt}, {"inlineData": {"mimeType": mime_type, "data": base64_image}}]}]}
+    if _is_multi(focus_keyword): payload["generationConfig"] = {"responseMimeType": "application/json"}
+    return api_url, {}, payload
+def _google_verdict(result, focus_keyword=None):
+    if "candidates" not in result or not result["candidates"]: return None
+    text_result = result["candidates"][0]["content"]["parts"][0]["text"].strip().lower()
+    if _is_multi(focus_keyword): return _multi_verdict(text_result, focus_keyword)
+    return int('yes' in text_result)
+def _openai_request(focus_keyword, api_key, model_name, base64_image, mime_type):
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    prompt = f"You are an image analyst. Your task is to determine if '{focus_keyword}' is the main subject. Answer only 'yes' or 'no'."
+    if _is_multi(focus_keyword): prompt = _multi_prompt(focus_keyword, scored=False)
+    payload = { "model": model_name, "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": _data_url(mime_type, base64_image)}}]}], "max_tokens": 10 }
+    if _is_multi(focus_keyword): payload.update(max_tokens=16 + 12 * len(focus_keyword), response_format={"type": "json_object"})
+    return headers, payload
+def _openai_verdict(result, focus_keyword=None):
+    text_result = result['choices'][0]['message']['content'].strip().lower()
+    if _is_multi(focus_keyword): return _multi_verdict(text_result, focus_keyword)
+    return int('yes' in text_result)
+def _ollama_prompt(focus_keyword, mode, prompt_mode):
+    if _is_multi(focus_keyword): return _multi_prompt(focus_keyword, scored=mode == 'confidence')
+    if mode == 'confidence':
+        return f"On a scale of 1 to 10, where 1 is 'not at all' and 10 is 'absolutely certain', how confident are you that the main subject of this image is a '{focus_keyword}'? Your response must be only the number."
+    if prompt_mode == 'cot':
+        return f"First, briefly describe the image in one sentence. Then, based on your description, determine if a '{focus_keyword}' is the main subject. Finally, answer with a single word on a new line: 'yes' or 'no'."
+    return f"You are an expert image analyst. Your only task is to determine if the main subject of the image is a '{focus_keyword}'. Your entire response must be a single word: 'yes' or 'no'. Is the main subject a '{focus_keyword}'?"
+def _ollama_request(focus_keyword, model_name, mode, prompt_mode, temperature, base64_image, generation=None):
+    generation = generation or {}
+    payload = { "model": model_name, "prompt": _ollama_prompt(focus_keyword, mode, prompt_mode), "stream": bool(generation.get('stream')), "images": [base64_image], "options": { "temperature": temperature } }
+    if generation.get('num_predict'): payload["options"]["num_predict"] = generation['num_predict']
+    if generation.get('keep_alive') is not None: payload["keep_alive"] = generation['keep_alive']
+    if _is_multi(focus_keyword): payload["format"] = "json"
+    return payload
+def ollama_generation_options(params):
+    # Short answers need only a few tokens; 'cot' keeps room for its one-sentence description.
+    default_num_predict = 160 if params.get('mode') == 'yesno' and params.get('prompt_mode') == 'cot' else 4
+    if _is_multi(params.get('focus_keyword')): default_num_predict = 16 + 12 * len(params['focus_keyword'])
+    return {'stream': params.get('ollama_stream', True), 'num_predict': params.get('num_predict', default_num_predict), 'keep_alive': params.get('keep_alive', '30m')}
+def _ollama_verdict(response_text, mode, focus_keyword=None, threshold=None):
+    if _is_multi(focus_keyword): return _multi_verdict(response_text, focus_keyword, threshold if mode == 'confidence' else None)
+    response_text = response_text.strip().lower()
+    if mode == 'confidence': return int(response_text.split('.')[0])
+    final_answer = response_text.split('\n')[-1].strip()
+    return int('yes' in final_answer)
+def _ollama_partial_verdict(response_text, mode, prompt_mode, focus_keyword=None, threshold=None):
+    # Decides from a partial streamed answer; None means more tokens are needed.
+    text = response_text.lower()
+    if _is_multi(focus_keyword):
+        if not text.rstrip().endswith('}'): return None
+        try:
+            return _ollama_verdict(text, mode, focus_keyword, threshold)
+        except ValueError:
+            return None
+    if mode == 'confidence':
+        match = re.match(r'\s*(\d+)(\D)?', text)
+        if match and (match.group(2) is not None or len(match.group(1)) >= 2): return int(match.group(1))
+        return None
+    if prompt_mode == 'cot':
+        for line in text.split('\n')[1:-1]:
+            match = re.fullmatch(r'\W*(?:final answer|answer)?\W*(yes|no)\W*', line.strip())
+            if match: return int(match.group(1) == 'yes')
+        return None
+    match = re.match(r'\W*(yes|no)\W', text)
+    return int(match.group(1) == 'yes') if match else None
+def _read_ollama_stream(response, mode, prompt_mode, focus_keyword=None, threshold=None):
+    response_text = ""
     try:
-        response = requests.post(api_url, json=payload, timeout=90)
+        for line in response.iter_lines():
+            if not line: continue
+            chunk = json.loads(line)
+            if chunk.get("error"): raise ValueError(chunk["error"])
+            response_text += chunk.get("response", "")
+            if chunk.get("done"): break
+            verdict = _ollama_partial_verdict(response_text, mode, prompt_mode, focus_keyword, threshold)
+            # Closing the response drops the connection, which makes Ollama stop generating.
+            if verdict is not None: return verdict
+    finally:
+        response.close()
+    return _ollama_verdict(response_text, mode, focus_keyword, threshold)
+def warm_up_ollama(model_name, keep_alive, log_callback, session=None, base_url=OLLAMA_BASE_URL):
+    where = "" if base_url == OLLAMA_BASE_URL else f" on {base_url}"
+    log_callback(f"Loading Ollama model '{model_name}'{where}...")
+    started = time.monotonic()
+    try:
+        (session or requests).post(f"{base_url}/api/generate", json={"model": model_name, "keep_alive": keep_alive}, timeout=300).raise_for_status()
+        log_callback(f"Model '{model_name}' is ready{where} ({time.monotonic() - started:.1f}s).")
+    except requests.exceptions.RequestException as e:
+        log_callback(f"Warning: Could not warm up Ollama model '{model_name}'{where}: {e}")
+# --- Pool of Ollama endpoints: least-outstanding dispatch, health checks, ejection and hedged retries ---
+class NoOllamaEndpointError(requests.exceptions.ConnectionError):
+    pass
+# Only these count against an endpoint; an HTTP error answer comes from a live server and belongs to the image.
+_ENDPOINT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)
+class OllamaEndpoint:
+    def __init__(self, url, limit=4):
+        self.url = url.rstrip('/')
+        self.limit = max(1, limit)
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.completed = 0
+        self.errors = 0
+        self.ejections = 0
+        self.latency = None
+def parse_ollama_hosts(params):
+    # Hosts are 'http://host:11434' or 'host:11434=2', where '=N' overrides the per-host concurrency.
+    endpoints = []
+    for host in params.get('ollama_hosts') or [OLLAMA_BASE_URL]:
+        url, _, limit = host.strip().partition('=')
+        if '://' not in url: url = f"http://{url}"
+        endpoints.append(OllamaEndpoint(url, int(limit) if limit else params.get('host_concurrency', 4)))
+    return endpoints
+class OllamaPool:
+    def __init__(self, endpoints, log_callback, eject_after=3, health_interval=15.0, hedge_after=None, max_dispatch=3):
+        self.endpoints = endpoints
+        self.max_dispatch = max(1, max_dispatch)
+        self.log_callback = log_callback
+        self.eject_after = eject_after
+        self.health_interval = health_interval
+        self.hedge_after = hedge_after
+        self.hedged = 0
+        self.capacity = sum(endpoint.limit for endpoint in endpoints)
+        self._cond = threading.Condition()
+        self._closed = threading.Event()
+        if len(endpoints) > 1: threading.Thread(target=self._health_loop, daemon=True).start()
+    def acquire(self, cancel_event=None, exclude=None, wait=True):
+        with self._cond:
+            while True:
+                if cancel_event is not None and cancel_event.is_set(): raise ScanCancelledError()
+                live = [endpoint for endpoint in self.endpoints if endpoint.healthy and endpoint not in (exclude or ())]
+                if not live: return None
+                free = [endpoint for endpoint in live if endpoint.outstanding < endpoint.limit]
+                if free:
+                    # A host without a latency sample ranks as average, not fastest, so an unproven host cannot win every tie.
+                    known = [endpoint.latency for endpoint in live if endpoint.latency is not None]
+                    neutral = sum(known) / len(known) if known else 0.0
+                    endpoint = min(free, key=lambda candidate: (candidate.outstanding / candidate.limit, neutral if candidate.latency is None else candidate.latency))
+                    endpoint.outstanding += 1
+                    return endpoint
+                if not wait: return None
+                self._cond.wait(0.25)
+    def release(self, endpoint, latency=None, failed=False):
+        with self._cond:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.errors += 1
+                endpoint.failures += 1
+                if endpoint.healthy and endpoint.failures >= self.eject_after: self._eject(endpoint)
+            elif latency is not None:
+                endpoint.failures = 0
+                endpoint.completed += 1
+                endpoint.latency = latency if endpoint.latency is None else 0.8 * endpoint.latency + 0.2 * latency
+            self._cond.notify_all()
+    def _eject(self, endpoint):
+        endpoint.healthy = False
+        endpoint.ejections += 1
+        live = sum(candidate.healthy for candidate in self.endpoints)
+        self.log_callback(f"Warning: Ollama endpoint {endpoint.url} is not responding, taking it out of rotation ({live} left).")
+    def _health_loop(self):
+        while not self._closed.wait(self.health_interval):
+            for endpoint in self.endpoints:
+                try:
+                    alive = requests.get(endpoint.url, timeout=5).status_code == 200
+                except requests.exceptions.RequestException:
+                    alive = False
+                with self._cond:
+                    if alive and not endpoint.healthy:
+                        endpoint.healthy, endpoint.failures = True, 0
+                        self.log_callback(f"Ollama endpoint {endpoint.url} is back, returning it to rotation.")
+                        self._cond.notify_all()
+                    elif not alive and endpoint.healthy:
+                        self._eject(endpoint)
+    def _attempt(self, endpoint, call, cancel_event, abandoned=None):
+        started = time.monotonic()
+        try:
+            result = call(endpoint.url)
+        except _ENDPOINT_ERRORS:
+            # A stop or a lost hedge race aborts the connection; that is not the endpoint's fault.
+            self.release(endpoint, failed=not (cancel_event is not None and cancel_event.is_set() or abandoned is not None and abandoned.is_set()))
+            raise
+        except BaseException:
+            self.release(endpoint)
+            raise
+        self.release(endpoint, time.monotonic() - started)
+        return result
+    def _hedged(self, endpoint, call, cancel_event, tried, session=None):
+        outcomes = queue.Queue()
+        lock = threading.Lock()
+        attempts = []
+        def attempt(target, state):
+            state['thread'] = threading.get_ident()
+            try:
+                outcome = (True, self._attempt(target, call, cancel_event, state['abandoned']))
+            except BaseException as e:
+                outcome = (False, e)
+            with lock: state['done'] = True
+            outcomes.put(outcome)
+        def launch(target):
+            state = {'thread': None, 'done': False, 'abandoned': threading.Event()}
+            attempts.append(state)
+            threading.Thread(target=attempt, args=(target, state), daemon=True).start()
+        launch(endpoint)
+        try:
+            ok, value = outcomes.get(timeout=self.hedge_after)
+        except queue.Empty:
+            # A straggler: send the same request to another idle endpoint and keep whichever answers first.
+            backup = self.acquire(cancel_event, exclude=tried, wait=False)
+            if backup is not None:
+                tried.add(backup)
+                with self._cond: self.hedged += 1
+                launch(backup)
+            ok, value = outcomes.get()
+        if not ok and len(attempts) == 2: ok, value = outcomes.get()
+        if ok and session is not None:
+            # The losing request would hold its endpoint's slot until the model finishes, so its connection is cut.
+            with lock:
+                for state in attempts:
+                    if state['done'] or state['thread'] is None: continue
+                    state['abandoned'].set()
+                    abort_http_session(session, state['thread'])
+        if ok: return value
+        raise value
+    def run(self, call, cancel_event=None, session=None):
+        # Connection failures move the request to an endpoint it has not tried yet, up to max_dispatch times; the scan only stops when none is left.
+        tried = set()
+        dispatched = 0
+        while True:
+            endpoint = self.acquire(cancel_event, exclude=tried)
+            if endpoint is None:
+                if tried and any(candidate.healthy for candidate in self.endpoints): raise last_error
+                raise NoOllamaEndpointError("No Ollama endpoint is reachable.")
+            tried.add(endpoint)
+            dispatched += 1
+            try:
+                if self.hedge_after is None: return self._attempt(endpoint, call, cancel_event)
+                return self._hedged(endpoint, call, cancel_event, tried, session)
+            except _ENDPOINT_ERRORS as e:
+                if cancel_event is not None and cancel_event.is_set(): raise
+                e.dispatches = dispatched
+                last_error = e
+                if dispatched >= self.max_dispatch and any(candidate.healthy for candidate in self.endpoints): raise
+    def warm_up(self, model_name, keep_alive, log_callback, session=None):
+        threads = [threading.Thread(target=warm_up_ollama, args=(model_name, keep_alive, log_callback, session, endpoint.url), daemon=True) for endpoint in self.endpoints]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+    def close(self):
+        self._closed.set()
+    def summary(self):
+        hosts = "; ".join(f"{endpoint.url}: {endpoint.completed} done, {endpoint.errors} errors" + (f", ejected {endpoint.ejections}x" if endpoint.ejections else "") for endpoint in self.endpoints)
+        return f"Ollama endpoints: {hosts}." + (f" {self.hedged} hedged requests." if self.hedge_after is not None else "")
+def create_ollama_pool(params, log_callback):
+    return OllamaPool(parse_ollama_hosts(params), log_callback, params.get('eject_after', 3), params.get('health_interval', 15.0), params.get('hedge_after'), params.get('max_dispatch', 3))
+def _load_for_request(image_path, image_data, preprocessor, log_callback):
+    try:
+        base64_image, mime_type = image_data or get_image_data(image_path, preprocessor)
+        return (base64_image, mime_type) if base64_image else None
+    except IOError as e:
+        log_callback(f"Error reading file {os.path.basename(image_path)}: {e}")
+        return None
+
+def process_with_google(image_path, focus_keyword, api_key, debug_mode, log_callback, cache=None, preprocessor=None, image_data=None, session=None, limiter=None, api_base=GOOGLE_API_BASE):
+    cache_key, cached = _cache_lookup(cache, image_path, ('google', GOOGLE_MODEL_NAME, 'yesno', None, focus_keyword), log_callback, lookup=image_data is None)
+    if cached is not None: return _verdict_result(image_path, cached, focus_keyword=focus_keyword)
+    image_data = _load_for_request(image_path, image_data, preprocessor, log_callback)
+    if not image_data: return None
+    api_url, headers, payload = _google_request(focus_keyword, api_key, *image_data, api_base=api_base)
+    try:
+        response = post_with_retry(session or requests, api_url, limiter, log_callback, "Google", headers=headers, json=payload, timeout=90)
         if response.status_code != 200:
             log_callback(f"Warning (Google): Bad status code {response.status_code} for {os.path.basename(image_path)}.")
+            _note_image_error(session, image_path)
             return None
+        started = time.monotonic()
         result = response.json()
-        if "candidates" not in result or not result["candidates"]: return None
-        text_result = result["candidates"][0]["content"]["parts"][0]["text"].strip().lower()
-        if 'yes' in text_result: return image_path
-        return None
+        _record_usage(limiter, result)
+        verdict = _google_verdict(result, focus_keyword)
+        _observe_since(session, 'parse', started)
+        if verdict is None:
+            _note_image_error(session, image_path)
+            return None
+        _cache_store(cache, cache_key, verdict)
+        return _verdict_result(image_path, verdict, focus_keyword=focus_keyword)
+    except _PROPAGATED_ERRORS:
+        raise
     except Exception as e:
+        _raise_if_cancelled(session)
         log_callback(f"Error (Google) with {os.path.basename(image_path)}: {e}")
+        _note_image_error(session, image_path)
         return None
-def process_with_openai_compatible(image_path, focus_keyword, api_key, debug_mode, api_url, model_name, provider_name, log_callback):
+def process_with_openai_compatible(image_path, focus_keyword, api_key, debug_mode, api_url, model_name, provider_name, log_callback, cache=None, preprocessor=None, image_data=None, session=None, limiter=None):
+    cache_key, cached = _cache_lookup(cache, image_path, (provider_name.lower(), model_name, 'yesno', None, focus_keyword), log_callback, lookup=image_data is None)
+    if cached is not None: return _verdict_result(image_path, cached, focus_keyword=focus_keyword)
+    image_data = _load_for_request(image_path, image_data, preprocessor, log_callback)
+    if not image_data: return None
+    headers, payload = _openai_request(focus_keyword, api_key, model_name, *image_data)
     try:
-        base64_image, mime_type = get_image_data(image_path)
-        if not base64_image: return None
-    except IOError as e:
-        log_callback(f"Error reading file {os.path.basename(image_path)}: {e}")
-        return None
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
-    prompt = f"You are an image analyst. Your task is to determine if '{focus_keyword}' is the main subject. Answer only 'yes' or 'no'."
-    payload = { "model": model_name, "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}]}], "max_tokens": 10 }
-    try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=90)
+        response = post_with_retry(session or requests, api_url, limiter, log_callback, provider_name, headers=headers, json=payload, timeout=90)
         if response.status_code != 200:
             log_callback(f"Warning ({provider_name}): Bad status {response.status_code} for {os.path.basename(image_path)}.")
+            _note_image_error(session, image_path)
             return None
+        started = time.monotonic()
         result = response.json()
-        text_result = result['choices'][0]['message']['content'].strip().lower()
-        if 'yes' in text_result: return image_path
-        return None
+        _record_usage(limiter, result)
+        verdict = _openai_verdict(result, focus_keyword)
+        _observe_since(session, 'parse', started)
+        _cache_store(cache, cache_key, verdict)
+        return _verdict_result(image_path, verdict, focus_keyword=focus_keyword)
+    except _PROPAGATED_ERRORS:
+        raise
     except Exception as e:
+        _raise_if_cancelled(session)
         log_callback(f"Error ({provider_name}) with {os.path.basename(image_path)}: {e}")
+        _note_image_error(session, image_path)
         return None
-def process_with_ollama(image_path, focus_keyword, model_name, mode, threshold, prompt_mode, temperature, log_callback):
+# --- Multi-image packing for cloud providers: N labelled images per request, one JSON verdict per image ---
+class BatchStats:
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.images = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+    def record(self, images, prompt_tokens=0, completion_tokens=0):
+        with self._lock:
+            self.requests += 1
+            self.images += images
+            self.prompt_tokens += prompt_tokens or 0
+            self.completion_tokens += completion_tokens or 0
+    def fell_back(self):
+        with self._lock: self.fallbacks += 1
+    def summary(self):
+        per_request = f"{self.images / self.requests:.1f}" if self.requests else "0"
+        return f"Batching ({self.name}): {self.images} images in {self.requests} requests ({per_request} per request), {self.prompt_tokens:,} prompt + {self.completion_tokens:,} completion tokens; {self.fallbacks} batches fell back to single-image requests."
+def _batch_prompt(focus_keyword, count):
+    if _is_multi(focus_keyword):
+        listed = ", ".join(f"'{keyword}'" for keyword in focus_keyword)
+        return f"You are an image analyst. You will see {count} images, each preceded by its label 'Image 1' to 'Image {count}'. For each image and each of these subjects: {listed}, decide whether the subject is the main subject of that image. Respond only with a JSON object that maps every image number to an object mapping every subject to true or false."
+    return f"You are an image analyst. You will see {count} images, each preceded by its label 'Image 1' to 'Image {count}'. For each image, determine if '{focus_keyword}' is its main subject. Respond only with a JSON object that maps every image number to \"yes\" or \"no\", for example {{\"1\": \"yes\", \"2\": \"no\"}}."
+def _batch_verdicts(response_text, count, focus_keyword):
+    # Any missing or unreadable entry rejects the whole answer, so the batch is retried image by image.
+    match = re.search(r'\{.*\}', response_text, re.S)
+    if not match: raise ValueError("batch answer is not a JSON object")
+    answers = {re.sub(r'\D', '', str(key)): value for key, value in json.loads(match.group(0)).items()}
+    verdicts = []
+    for number in range(1, count + 1):
+        answer = answers.get(str(number))
+        if _is_multi(focus_keyword):
+            if not isinstance(answer, dict): raise ValueError(f"no answer for image {number}")
+            verdicts.append(_multi_verdict(json.dumps(answer), focus_keyword))
+            continue
+        if isinstance(answer, str): answer = {'yes': True, 'true': True, 'no': False, 'false': False}.get(answer.strip().lower())
+        if not isinstance(answer, bool): raise ValueError(f"no answer for image {number}")
+        verdicts.append(int(answer))
+    return verdicts
+def _store_batch(items, verdicts, cache, cache_fields, focus_keyword, log_callback):
+    results = []
+    for (image_path, _), verdict in zip(items, verdicts):
+        cache_key, _ = _cache_lookup(cache, image_path, cache_fields, log_callback, lookup=False)
+        _cache_store(cache, cache_key, verdict)
+        results.append(_verdict_result(image_path, verdict, focus_keyword=focus_keyword))
+    return results
+def process_batch_with_google(items, focus_keyword, api_key, log_callback, cache=None, session=None, limiter=None, stats=None, api_base=GOOGLE_API_BASE):
+    api_url = f"{api_base}/v1beta/models/{GOOGLE_MODEL_NAME}:generateContent?key={api_key}"
+    parts = [{"text": _batch_prompt(focus_keyword, len(items))}]
+    for number, (_, (base64_image, mime_type)) in enumerate(items, 1):
+        parts += [{"text": f"Image {number}:"}, {"inlineData": {"mimeType": mime_type, "data": base64_image}}]
+    payload = {"contents": [{"parts": parts}], "generationConfig": {"responseMimeType": "application/json"}}
     try:
-        base64_image, _ = get_image_data(image_path)
-        if not base64_image: return None
-    except IOError as e:
-        log_callback(f"Error reading file {os.path.basename(image_path)}: {e}")
+        response = post_with_retry(session or requests, api_url, limiter, log_callback, "Google", json=payload, timeout=180)
+        if response.status_code != 200:
+            log_callback(f"Warning (Google): Bad status code {response.status_code} for a batch of {len(items)} images.")
+            return None
+        result = response.json()
+        _record_usage(limiter, result)
+        usage = result.get("usageMetadata", {})
+        if stats is not None: stats.record(len(items), usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+        started = time.monotonic()
+        verdicts = _batch_verdicts(result["candidates"][0]["content"]["parts"][0]["text"], len(items), focus_keyword)
+        _observe_since(session, 'parse', started)
+        return _store_batch(items, verdicts, cache, ('google', GOOGLE_MODEL_NAME, 'yesno', None, focus_keyword), focus_keyword, log_callback)
+    except _PROPAGATED_ERRORS:
+        raise
+    except Exception as e:
+        _raise_if_cancelled(session)
+        log_callback(f"Warning (Google): Could not use the answer for a batch of {len(items)} images ({e}).")
         return None
-    prompt = ""
-    if mode == 'confidence':
-        prompt = f"On a scale of 1 to 10, where 1 is 'not at all' and 10 is 'absolutely certain', how confident are you that the main subject of this image is a '{focus_keyword}'? Your response must be only the number."
-    else: # mode == 'yesno'
-        if prompt_mode == 'cot':
-            prompt = f"First, briefly describe the image in one sentence. Then, based on your description, determine if a '{focus_keyword}' is the main subject. Finally, answer with a single word on a new line: 'yes' or 'no'."
-        else: # Simple mode
-            prompt = f"You are an expert image analyst. Your only task is to determine if the main subject of the image is a '{focus_keyword}'. Your entire response must be a single word: 'yes' or 'no'. Is the main subject a '{focus_keyword}'?"
-    ollama_api_url = "http://localhost:11434/api/generate"
-    payload = { "model": model_name, "prompt": prompt, "stream": False, "images": [base64_image], "options": { "temperature": temperature } }
+def process_batch_with_openai_compatible(items, focus_keyword, api_key, api_url, model_name, provider_name, log_callback, cache=None, session=None, limiter=None, stats=None):
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    content = [{"type": "text", "text": _batch_prompt(focus_keyword, len(items))}]
+    for number, (_, (base64_image, mime_type)) in enumerate(items, 1):
+        content += [{"type": "text", "text": f"Image {number}:"}, {"type": "image_url", "image_url": {"url": _data_url(mime_type, base64_image)}}]
+    answer_tokens = 12 * len(focus_keyword) if _is_multi(focus_keyword) else 8
+    payload = {"model": model_name, "messages": [{"role": "user", "content": content}], "max_tokens": 20 + answer_tokens * len(items), "response_format": {"type": "json_object"}}
     try:
-        response = requests.post(ollama_api_url, json=payload, timeout=180)
+        response = post_with_retry(session or requests, api_url, limiter, log_callback, provider_name, headers=headers, json=payload, timeout=180)
+        if response.status_code != 200:
+            log_callback(f"Warning ({provider_name}): Bad status {response.status_code} for a batch of {len(items)} images.")
+            return None
+        result = response.json()
+        _record_usage(limiter, result)
+        usage = result.get("usage", {})
+        if stats is not None: stats.record(len(items), usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        started = time.monotonic()
+        verdicts = _batch_verdicts(result['choices'][0]['message']['content'], len(items), focus_keyword)
+        _observe_since(session, 'parse', started)
+        return _store_batch(items, verdicts, cache, (provider_name.lower(), model_name, 'yesno', None, focus_keyword), focus_keyword, log_callback)
+    except _PROPAGATED_ERRORS:
+        raise
+    except Exception as e:
+        _raise_if_cancelled(session)
+        log_callback(f"Warning ({provider_name}): Could not use the answer for a batch of {len(items)} images ({e}).")
+        return None
+def _batch_classifier(process_batch, classify, stats):
+    def classify_batch(items):
+        results = process_batch(items) if len(items) > 1 else None
+        if results is not None: return results
+        if len(items) > 1: stats.fell_back()
+        return [classify(image_path, image_data) for image_path, image_data in items]
+    return classify_batch
+def process_with_ollama(image_path, focus_keyword, model_name, mode, threshold, prompt_mode, temperature, log_callback, cache=None, preprocessor=None, image_data=None, session=None, limiter=None, generation=None, return_score=False, pool=None):
+    cache_key, cached = _cache_lookup(cache, image_path, ('ollama', model_name, _ollama_cache_mode(mode, prompt_mode, focus_keyword, threshold), temperature, focus_keyword), log_callback, lookup=image_data is None)
+    if cached is not None: return cached if return_score else _verdict_result(image_path, cached, threshold if mode == 'confidence' else None, focus_keyword)
+    image_data = _load_for_request(image_path, image_data, preprocessor, log_callback)
+    if not image_data: return None
+    payload = _ollama_request(focus_keyword, model_name, mode, prompt_mode, temperature, image_data[0], generation)
+    def request(base_url):
+        response = post_with_retry(session or requests, f"{base_url}/api/generate", limiter, log_callback, "Ollama", retry_timeouts=pool is None, json=payload, timeout=180, stream=payload["stream"])
         response.raise_for_status()
-        response_text = json.loads(response.text)["response"].strip().lower()
-        if mode == 'confidence':
-            score = int(response_text.split('.')[0])
-            if score >= threshold: return image_path
-        else:
-            final_answer = response_text.split('\n')[-1].strip()
-            if 'yes' in final_answer: return image_path
+        started = time.monotonic()
+        if payload["stream"]:
+            # Generation happens while the stream is read, so it is timed as 'receive' (it includes the incremental parsing).
+            verdict = _read_ollama_stream(response, mode, prompt_mode, focus_keyword, threshold)
+            _observe_since(session, 'receive', started)
+            return verdict
+        verdict = _ollama_verdict(json.loads(response.text)["response"], mode, focus_keyword, threshold)
+        _observe_since(session, 'parse', started)
+        return verdict
+    try:
+        verdict = pool.run(request, getattr(session, 'cancel_event', None), session) if pool is not None else request(OLLAMA_BASE_URL)
+        _cache_store(cache, cache_key, verdict)
+        if return_score: return verdict
+        return _verdict_result(image_path, verdict, threshold if mode == 'confidence' else None, focus_keyword)
+    except requests.exceptions.HTTPError as e:
+        _raise_if_cancelled(session)
+        log_callback(f"Error (Ollama) with {os.path.basename(image_path)}: {e}")
+        _note_image_error(session, image_path)
         return None
-    except requests.exceptions.RequestException:
-        log_callback("Error: Could not connect to Ollama server. Is it running?")
+    except requests.exceptions.RequestException as e:
+        _raise_if_cancelled(session)
+        if pool is not None and not isinstance(e, NoOllamaEndpointError):
+            # Other endpoints are still live; only this image gives up after its re-dispatches.
+            dispatches = getattr(e, 'dispatches', 1)
+            log_callback(f"Error (Ollama) with {os.path.basename(image_path)}: no answer after {dispatches} attempt{'s' if dispatches != 1 else ''} ({e}).")
+            _note_image_error(session, image_path)
+            return None
+        log_callback("Error: Could not connect to any Ollama endpoint. Are they running?" if pool is not None and len(pool.endpoints) > 1 else "Error: Could not connect to Ollama server. Is it running?")
         return "STOP"
+    except _PROPAGATED_ERRORS:
+        raise
     except Exception as e:
+        _raise_if_cancelled(session)
         log_callback(f"Error (Ollama) with {os.path.basename(image_path)}: {e}")
+        _note_image_error(session, image_path)
         return None
 
 # ### <<< שינוי לפונקציה גמישה יותר
-def process_output_files(image_list, target_folder, action, log_callback):
+# --- Output stage: matches are routed while the scan runs, on a small I/O pool ---
+OUTPUT_ACTIONS = ('copy', 'move', 'hardlink', 'reflink')
+FICLONE = 0x40049409
+_OUTPUT_VERBS = {'copy': "Copying", 'move': "Moving", 'hardlink': "Linking", 'reflink': "Cloning"}
+def _copy_file(src, dst, reflink=False):
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+        method = 'copied'
+        if reflink and fcntl is not None and sys.platform.startswith('linux'):
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                method = 'reflinked'
+            except OSError:
+                pass
+        if method == 'copied':
+            try:
+                # copy_file_range stays in the kernel and lets btrfs/XFS share extents or NFS/SMB copy server-side.
+                if not hasattr(os, 'copy_file_range'): raise OSError(errno.ENOSYS, "copy_file_range unavailable")
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30): pass
+            except OSError:
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+                shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+    return method
+def _same_file(src, dst):
+    # The same inode (a hardlink) or byte-identical content; equal size and mtime alone do not prove a copy.
+    try:
+        if os.path.samefile(src, dst): return True
+        if os.stat(src).st_size != os.stat(dst).st_size: return False
+        return filecmp.cmp(src, dst, shallow=False)
+    except OSError:
+        return False
+_CONTESTED = object()
+class FileRouter:
+    def __init__(self, target_folder, action='copy', log_callback=print, layout='flat', roots=(), workers=4):
+        self.target_folder = os.path.abspath(target_folder)
+        self.action = action if action in OUTPUT_ACTIONS else 'copy'
+        self.layout = layout
+        self.roots = sorted((os.path.abspath(root) for root in roots), key=len, reverse=True)
+        self.log_callback = log_callback
+        self.counts = {}
+        self.renamed = 0
+        self.errors = 0
+        # Destination -> (source, subfolder) and back, so a name shared by several sources and a source routed again resolve the same way every time.
+        self._owners = {}
+        self._routed = {}
+        self._busy = set()
+        self._evict = {}
+        self._lock = threading.Lock()
+        self._link_warned = False
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, workers))]
+        for thread in self._threads: thread.start()
+    def submit(self, path, subfolders=None):
+        self._queue.put((path, subfolders or [None]))
+    @staticmethod
+    def _suffixed(candidate, src, attempt=1):
+        stem, ext = os.path.splitext(candidate)
+        # The suffix is derived from the source path, so a name collision resolves the same way on every run.
+        suffix = hashlib.sha1(src.encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+        return f"{stem}~{suffix}{ext}" if attempt == 1 else f"{stem}~{suffix}-{attempt}{ext}"
+    def _destination(self, src, subfolder, action, origin):
+        # Names and ownership follow the original source path, also for links made after a move.
+        relative = os.path.basename(origin)
+        if self.layout == 'mirror':
+            root = next((root for root in self.roots if origin.startswith(root + os.sep)), None)
+            if root: relative = os.path.relpath(origin, root)
+        plain = os.path.join(self.target_folder, subfolder or '', relative)
+        with self._lock:
+            routed = self._routed.get((origin, subfolder))
+            if routed is not None and os.path.lexists(routed):
+                # A source routed again (watch mode sees files rewritten in place) replaces its earlier copy.
+                if action != 'move' and _same_file(src, routed): return routed, 'present'
+                self._busy.add(routed)
+                return routed, 'replace'
+            suffixed = self._suffixed(plain, origin)
+            if suffixed not in self._owners and action != 'move' and os.path.lexists(suffixed) and _same_file(src, suffixed):
+                # An earlier run already found this name shared and kept the source under its suffix.
+                self._owners[suffixed] = (origin, subfolder)
+                self._routed[(origin, subfolder)] = suffixed
+                return suffixed, 'present'
+            for attempt in range(100):
+                candidate = self._suffixed(plain, origin, attempt) if attempt else plain
+                owner = self._owners.get(candidate)
+                if owner is not None and owner != (origin, subfolder):
+                    # Every source sharing a name gets its suffix, whichever of them finished first.
+                    if attempt == 0 and owner is not _CONTESTED: self._contest(plain, owner)
+                    continue
+                state = 'new'
+                if os.path.lexists(candidate):
+                    if action != 'move' and _same_file(src, candidate): state = 'present'
+                    # The suffixed name belongs to this source by construction: a leftover there is its stale copy.
+                    elif attempt == 1: state = 'replace'
+                    else: continue
+                self._owners[candidate] = (origin, subfolder)
+                self._routed[(origin, subfolder)] = candidate
+                if state != 'present': self._busy.add(candidate)
+                if attempt and state == 'new': self.renamed += 1
+                return candidate, state
+        raise OSError(errno.EEXIST, "no free destination name", plain)
+    def _contest(self, plain, owner):
+        # Called with the lock held: the earlier owner of a now shared name moves to its own suffixed name.
+        self._owners[plain] = _CONTESTED
+        target = self._suffixed(plain, owner[0])
+        self._owners[target] = owner
+        self._routed[owner] = target
+        self.renamed += 1
+        if plain in self._busy: self._evict[plain] = target
+        else: self._rename_owned(plain, target)
+    def _rename_owned(self, current, target):
+        try:
+            os.replace(current, target)
+        except OSError as e:
+            self.errors += 1
+            self.log_callback(f"Error renaming {os.path.basename(current)} to avoid a name collision: {e}")
+    def _finish(self, dst):
+        # Returns where the file ended up: a name contested while it was being written is renamed now.
+        with self._lock:
+            self._busy.discard(dst)
+            target = self._evict.pop(dst, None)
+            if target is None: return dst
+            self._rename_owned(dst, target)
+            return target
+    def _route(self, src, subfolder, action, origin=None):
+        dst, state = self._destination(src, subfolder, action, origin or src)
+        if state == 'present': return 'already present', dst
+        try:
+            method = self._write(src, dst, action, replace=state == 'replace')
+        finally:
+            dst = self._finish(dst)
+        return ('replaced' if state == 'replace' else method), dst
+    def _write(self, src, dst, action, replace=False):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if replace:
+            try:
+                os.unlink(dst)
+            except FileNotFoundError:
+                pass
+        if action == 'move':
+            try:
+                os.rename(src, dst)
+                return 'moved'
+            except OSError as e:
+                if e.errno != errno.EXDEV: raise
+            _copy_file(src, dst)
+            os.unlink(src)
+            return 'moved across devices'
+        if action == 'hardlink':
+            try:
+                os.link(src, dst)
+                return 'hardlinked'
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP): raise
+                if not self._link_warned:
+                    self._link_warned = True
+                    self.log_callback(f"Warning: Cannot hardlink into {self.target_folder} ({e.strerror}), copying instead.")
+        return _copy_file(src, dst, reflink=action == 'reflink')
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is _PIPELINE_DONE: return
+            src, subfolders = job
+            origin = src
+            for index, subfolder in enumerate(subfolders):
+                # An image matching several keywords is moved once, then linked into the other keyword folders.
+                action = 'hardlink' if self.action == 'move' and index else self.action
+                if action != self.action:
+                    # The moved file may since have been renamed by a name collision.
+                    with self._lock: src = self._routed.get((origin, subfolders[0]), src)
+                try:
+                    method, dst = self._route(src, subfolder, action, origin)
+                    if action == 'move': src = dst
+                    with self._lock: self.counts[method] = self.counts.get(method, 0) + 1
+                except Exception as e:
+                    with self._lock: self.errors += 1
+                    self.log_callback(f"Error {_OUTPUT_VERBS[action].lower()} file {os.path.basename(src)}: {e}")
+    def close(self):
+        for _ in self._threads: self._queue.put(_PIPELINE_DONE)
+        for thread in self._threads: thread.join()
+    def summary(self):
+        done = ", ".join(f"{count} {method}" for method, count in sorted(self.counts.items())) or "nothing"
+        return f"Output ({self.action} to {self.target_folder}): {done}; {self.renamed} renamed to avoid name collisions, {self.errors} errors."
+def create_file_router(params, roots, log_callback):
+    return FileRouter(params['destination_folder'], params.get('action', 'copy'), log_callback, params.get('output_layout', 'flat'), roots, params.get('output_workers', 4))
+def process_output_files(image_list, target_folder, action, log_callback, layout='flat', roots=(), workers=4):
     if not image_list: return
-    os.makedirs(target_folder, exist_ok=True)
-    
-    action_verb = "Copying" if action == 'copy' else "Moving"
-    log_callback(f"\n{action_verb} {len(image_list)} images to folder: {target_folder} ...")
-    
-    for file_path in image_list:
+    log_callback(f"\n{_OUTPUT_VERBS.get(action, 'Copying')} {len(image_list)} images to folder: {target_folder} ...")
+    router = FileRouter(target_folder, action, log_callback, layout, roots, workers)
+    for file_path in image_list: router.submit(file_path, _keyword_folders(file_path))
+    router.close()
+    log_callback(router.summary())
+
+
+# --- Streaming scan pipeline: discovery -> read/encode -> inference -> result sink ---
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.cr2', '.dng', '.tiff')
+_PIPELINE_DONE = object()
+# --- Parallel scandir enumeration with a persistent (path, size, mtime, inode) manifest ---
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.expanduser("~"), ".aiimagescanner", "manifest.sqlite3")
+class FileManifest:
+    def __init__(self, db_path=DEFAULT_MANIFEST_PATH, scope=""):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.scope = scope
+        self.listed_dirs = 0
+        self.unchanged_dirs = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dirs (scope TEXT, path TEXT, mtime_ns INTEGER, subdirs TEXT, PRIMARY KEY (scope, path))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (scope TEXT, path TEXT, dir TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, PRIMARY KEY (scope, path))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_dir ON files(scope, dir)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS handled (scope TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, PRIMARY KEY (scope, path))")
+        self._conn.commit()
+    def directory(self, path):
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns, subdirs FROM dirs WHERE scope=? AND path=?", (self.scope, path)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+    def files_in(self, path):
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, inode FROM files WHERE scope=? AND dir=?", (self.scope, path)).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+    def update_directory(self, path, mtime_ns, subdirs, files):
+        with self._lock:
+            self.listed_dirs += 1
+            self._conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", (self.scope, path, mtime_ns, json.dumps(subdirs)))
+            self._conn.execute("DELETE FROM files WHERE scope=? AND dir=?", (self.scope, path))
+            self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", [(self.scope, file_path, path, *meta) for file_path, meta in files])
+    def update_files(self, path, files):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", [(self.scope, file_path, path, *meta) for file_path, meta in files])
+    def handled(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, inode FROM handled WHERE scope=?", (self.scope,)).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+    def mark_handled(self, entries):
+        # Committed right away: a restarted watch must know what was classified even if this session is killed.
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO handled VALUES (?, ?, ?, ?, ?)", [(self.scope, path, *signature) for path, signature in entries])
+            self._conn.commit()
+    def note_unchanged(self):
+        with self._lock: self.unchanged_dirs += 1
+    def forget(self, paths):
+        # Their directories are marked stale, so the next delta scan re-lists them and retries these images.
+        with self._lock:
+            for path in paths:
+                self._conn.execute("DELETE FROM files WHERE scope=? AND path=?", (self.scope, path))
+                self._conn.execute("UPDATE dirs SET mtime_ns=-1 WHERE scope=? AND path=?", (self.scope, os.path.dirname(path)))
+    def close(self, commit=True):
+        # Only a completed scan is committed, so an interrupted delta scan is repeated in full next time.
+        with self._lock:
+            if commit: self._conn.commit()
+            else: self._conn.rollback()
+            self._conn.close()
+    def summary(self):
+        return f"Manifest: {self.listed_dirs} directories listed, {self.unchanged_dirs} unchanged directories skipped."
+def _manifest_scope(params):
+    # A delta scan only skips images already judged for the same keywords by the same provider and model.
+    keywords = params.get('focus_keyword')
+    keywords = sorted(keywords) if isinstance(keywords, (list, tuple)) else [keywords]
+    model = params.get('model_name') if params.get('provider') == 'ollama' or params.get('cascade_provider') else None
+    return json.dumps([params.get('provider'), model, params.get('cascade_provider'), keywords])
+def open_manifest(params, log_callback):
+    if not (params.get('use_manifest') or params.get('delta_only')): return None
+    try:
+        return FileManifest(params.get('manifest_path') or DEFAULT_MANIFEST_PATH, _manifest_scope(params))
+    except (OSError, sqlite3.Error) as e:
+        log_callback(f"Warning: File manifest unavailable, scanning everything ({e}).")
+        return None
+def enumerate_images(roots, recursive=True, workers=8, manifest=None, delta_only=False, stop_event=None, verify_files=False):
+    stop_event = stop_event or threading.Event()
+    dir_queue = queue.Queue()
+    out_queue = queue.Queue(maxsize=4096)
+    pending = [0]
+    lock = threading.Lock()
+    def push_dir(path):
+        with lock: pending[0] += 1
+        dir_queue.put(path)
+    def emit(image_path):
+        while not stop_event.is_set():
+            try:
+                out_queue.put(image_path, timeout=0.25)
+                return
+            except queue.Full:
+                continue
+    def scan_dir(path):
         try:
-            if action == 'copy':
-                shutil.copy2(file_path, os.path.join(target_folder, os.path.basename(file_path)))
-            elif action == 'move':
-                shutil.move(file_path, os.path.join(target_folder, os.path.basename(file_path)))
-        except Exception as e:
-            log_callback(f"Error {action_verb.lower()} file {os.path.basename(file_path)}: {e}")
-            
-    log_callback(f"File {action} process is complete.")
+            dir_mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        known = manifest.directory(path) if manifest is not None else None
+        if known and known[0] == dir_mtime:
+            # Entries only change a directory's mtime when added, removed or renamed, so its listing is reused.
+            manifest.note_unchanged()
+            if recursive:
+                for subdir in known[1]: push_dir(subdir)
+            if not verify_files:
+                if not delta_only:
+                    for image_path in manifest.files_in(path): emit(image_path)
+                return
+            # Files rewritten in place keep the directory's mtime; opting in stats every known entry to catch them.
+            changed = []
+            for image_path, meta in manifest.files_in(path).items():
+                try:
+                    st = os.stat(image_path)
+                except OSError:
+                    continue
+                current = (st.st_size, st.st_mtime_ns, st.st_ino)
+                if current != meta: changed.append((image_path, current))
+                if not delta_only or current != meta: emit(image_path)
+            if changed: manifest.update_files(path, changed)
+            return
+        subdirs, files = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(SUPPORTED_EXTENSIONS) and entry.is_file():
+                            if manifest is None:
+                                files.append((entry.path, None))
+                            else:
+                                st = entry.stat()
+                                files.append((entry.path, (st.st_size, st.st_mtime_ns, st.st_ino)))
+                    except OSError:
+                        continue
+        except OSError:
+            return
+        previous = manifest.files_in(path) if manifest is not None and delta_only else {}
+        if recursive:
+            for subdir in subdirs: push_dir(subdir)
+        for image_path, meta in files:
+            if not delta_only or previous.get(image_path) != meta: emit(image_path)
+        if manifest is not None: manifest.update_directory(path, dir_mtime, subdirs, files)
+    def worker():
+        while True:
+            path = dir_queue.get()
+            if path is None: return
+            try:
+                if not stop_event.is_set(): scan_dir(path)
+            finally:
+                with lock:
+                    pending[0] -= 1
+                    finished = pending[0] == 0
+                if finished:
+                    for _ in range(workers): dir_queue.put(None)
+                    # A consumer that stopped early no longer drains the queue, so this put must not block forever.
+                    emit(_PIPELINE_DONE)
+    roots = [os.path.abspath(root) for root in roots]
+    if not roots: return
+    for root in roots: push_dir(root)
+    for _ in range(max(1, workers)): threading.Thread(target=worker, daemon=True).start()
+    try:
+        while True:
+            item = out_queue.get()
+            if item is _PIPELINE_DONE: return
+            yield item
+    finally:
+        stop_event.set()
+# --- Watch mode: inotify (pyinotify) with a polling fallback, debounced until files stop changing ---
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+def _is_within(path, excluded):
+    return any(path == folder or path.startswith(folder + os.sep) for folder in excluded)
+def _start_inotify(roots, recursive, on_file, on_rescan):
+    if pyinotify is None: return None
+    class Handler(pyinotify.ProcessEvent):
+        def process_default(self, event):
+            if event.mask & pyinotify.IN_Q_OVERFLOW: on_rescan(None)
+            # Files can land in a new directory before its watch is added, so list it once.
+            elif event.dir: on_rescan(event.pathname)
+            else: on_file(event.pathname)
+    manager = pyinotify.WatchManager()
+    mask = pyinotify.IN_CREATE | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+    watches = {}
+    for root in roots: watches.update(manager.add_watch(root, mask, rec=recursive, auto_add=recursive, quiet=True))
+    if not watches or any(wd < 0 for wd in watches.values()): return None
+    return pyinotify.Notifier(manager, Handler())
+def watch_new_images(roots, recursive=True, stop_event=None, settle_seconds=2.0, poll_interval=5.0, include_existing=False, excluded=(), use_inotify=True, log_callback=None, manifest=None):
+    stop_event = stop_event or threading.Event()
+    roots = [os.path.abspath(root) for root in roots if os.path.isdir(root)]
+    excluded = [os.path.abspath(folder) for folder in excluded if folder]
+    pending = {}  # path -> (signature, time it last changed); a file is handed out once it stops changing
+    emitted = {}  # path -> signature already handed out, so every version of a file is classified exactly once
+    def note(path):
+        if path.lower().endswith(SUPPORTED_EXTENSIONS) and not _is_within(path, excluded): pending.setdefault(path, (None, 0))
+    def rescan(directory):
+        for image_path in enumerate_images([directory] if directory else roots, recursive, workers=4):
+            if image_path not in pending and emitted.get(image_path) != _file_signature(image_path): note(image_path)
+    def settled():
+        now = time.monotonic()
+        ready = []
+        for path, (signature, changed_at) in list(pending.items()):
+            current = _file_signature(path)
+            if current is None:
+                del pending[path]
+            elif current != signature:
+                pending[path] = (current, now)
+            elif now - changed_at >= settle_seconds:
+                del pending[path]
+                if emitted.get(path) != current:
+                    emitted[path] = current
+                    ready.append(path)
+        return ready
+    notifier = _start_inotify(roots, recursive, note, rescan) if use_inotify else None
+    if log_callback:
+        if use_inotify and notifier is None: log_callback("Warning: inotify is unavailable (pyinotify missing or watch limit reached), falling back to polling.")
+        log_callback(f"Watching {len(roots)} folder(s) for new images using {'inotify' if notifier else f'polling every {poll_interval:g}s'}. Press Stop to end.")
+    # With a manifest, a root watched before picks up what arrived or changed while no watcher ran; a new root starts from what is there now.
+    known = manifest.handled() if manifest is not None else {}
+    emitted.update(known)
+    baseline = [(root, (0, 0, 0)) for root in roots if root not in known]
+    for image_path in enumerate_images(roots, recursive, workers=4):
+        if include_existing or next((root for root in roots if _is_within(image_path, [root])), None) in known:
+            note(image_path)
+        elif not _is_within(image_path, excluded):
+            emitted[image_path] = _file_signature(image_path)
+            if emitted[image_path] is not None: baseline.append((image_path, emitted[image_path]))
+    if manifest is not None and baseline: manifest.mark_handled(baseline)
+    next_poll = time.monotonic() + poll_interval
+    try:
+        while not stop_event.is_set():
+            if notifier is not None:
+                if notifier.check_events(timeout=250):
+                    notifier.read_events()
+                    notifier.process_events()
+            else:
+                stop_event.wait(0.25)
+                if time.monotonic() >= next_poll:
+                    rescan(None)
+                    next_poll = time.monotonic() + poll_interval
+            for path in settled(): yield path
+    finally:
+        if notifier is not None: notifier.stop()
 
+def _start_stage(worker_count, in_queue, out_queue, downstream_count, handler, halt_event, on_error):
+    remaining = [worker_count]
+    lock = threading.Lock()
+    def worker():
+        try:
+            while True:
+                item = in_queue.get()
+                if item is _PIPELINE_DONE: break
+                if halt_event.is_set(): continue
+                try:
+                    handler(item)
+                except Exception as e:
+                    on_error(item, e)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                is_last = remaining[0] == 0
+            if is_last:
+                for _ in range(downstream_count): out_queue.put(_PIPELINE_DONE)
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(worker_count)]
+    for thread in threads: thread.start()
+    return threads
+def _start_batch_stage(worker_count, in_queue, out_queue, downstream_count, batch_size, handler, halt_event, on_error, linger=0.25):
+    # Like _start_stage, but each worker collects up to batch_size items, waiting at most `linger` seconds to fill a batch.
+    remaining = [worker_count]
+    lock = threading.Lock()
+    def worker():
+        try:
+            finished = False
+            while not finished:
+                batch = []
+                item = in_queue.get()
+                deadline = time.monotonic() + linger
+                while True:
+                    if item is _PIPELINE_DONE:
+                        finished = True
+                        break
+                    if not halt_event.is_set(): batch.append(item)
+                    if len(batch) >= batch_size: break
+                    try:
+                        item = in_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                if not batch or halt_event.is_set(): continue
+                try:
+                    handler(batch)
+                except Exception as e:
+                    for batch_item in batch: on_error(batch_item, e)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                is_last = remaining[0] == 0
+            if is_last:
+                for _ in range(downstream_count): out_queue.put(_PIPELINE_DONE)
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(worker_count)]
+    for thread in threads: thread.start()
+    return threads
+class ScanProvider:
+    def __init__(self, name, classify, cache_fields, threshold, build_request, parse_verdict, timeout, session=None, limiter=None, stop_on_connection_error=False, focus_keyword=None, pool=None, classify_batch=None, batch_stats=None):
+        self.name = name
+        self.pool = pool
+        self.classify_batch = classify_batch
+        self.batch_stats = batch_stats
+        self.focus_keyword = focus_keyword
+        self.classify = classify
+        self.cache_fields = cache_fields
+        self.threshold = threshold
+        self.build_request = build_request
+        self.parse_verdict = parse_verdict
+        self.timeout = timeout
+        self.session = session
+        self.limiter = limiter
+        self.stop_on_connection_error = stop_on_connection_error
+    def cached_result(self, cache, image_path, log_callback):
+        # (True, result) when the verdict is already cached, so the image never has to be loaded.
+        _, cached = _cache_lookup(cache, image_path, self.cache_fields, log_callback)
+        if cached is None: return False, None
+        return True, _verdict_result(image_path, cached, self.threshold, self.focus_keyword)
+    def image_failed(self, image_path):
+        return self.session is not None and image_path in getattr(self.session, 'image_errors', ())
+    def abort(self):
+        if self.session is not None: abort_http_session(self.session)
+    def close(self):
+        if self.pool is not None: self.pool.close()
+        if self.session is not None: self.session.close()
+    def summaries(self):
+        lines = [self.limiter.summary()] if self.limiter is not None else []
+        if self.batch_stats is not None and self.batch_stats.requests + self.batch_stats.fallbacks: lines.append(self.batch_stats.summary())
+        if self.pool is not None and (len(self.pool.endpoints) > 1 or self.pool.hedge_after is not None): lines.append(self.pool.summary())
+        return lines
 
-def find_images_logic(params, progress_callback, log_callback, stop_event):
-    directory = params['directory']
+# --- Confidence cascade: the local Ollama score decides clear cases, the cloud only the uncertain band ---
+CLOUD_COST_PER_IMAGE = {'google': 0.0002, 'chatgpt': 0.002, 'deepseek': 0.0005}
+class CascadeProvider(ScanProvider):
+    def __init__(self, local, cloud, classify, cost_per_image, accept, reject):
+        # No cache fields of its own: each tier caches under its own key, so plain Ollama and cloud scans share them.
+        super().__init__(f"Ollama -> {cloud.name}", classify, None, None, None, None, cloud.timeout, local.session, local.limiter, stop_on_connection_error=True, pool=local.pool)
+        self.local = local
+        self.cloud = cloud
+        self.accept = accept
+        self.reject = reject
+        self.cost_per_image = cost_per_image
+        self.counts = {'accepted': 0, 'rejected': 0, 'escalated': 0}
+        self._lock = threading.Lock()
+    def count(self, tier):
+        with self._lock: self.counts[tier] += 1
+    def cached_result(self, cache, image_path, log_callback):
+        # A cached score settles clear cases, a cached cloud verdict the uncertain ones; neither counts as a live decision.
+        _, score = _cache_lookup(cache, image_path, self.local.cache_fields, log_callback)
+        if score is not None and score >= self.accept: return True, image_path
+        if score is not None and score <= self.reject: return True, None
+        return self.cloud.cached_result(cache, image_path, log_callback)
+    def image_failed(self, image_path):
+        # A failed local score is escalated, so only the cloud tier can leave an image without a verdict.
+        return self.cloud.image_failed(image_path)
+    def abort(self):
+        self.local.abort()
+        self.cloud.abort()
+    def close(self):
+        self.local.close()
+        self.cloud.close()
+    def summaries(self):
+        local = self.counts['accepted'] + self.counts['rejected']
+        total = local + self.counts['escalated']
+        avoided = f"{local / total:.0%}" if total else "0%"
+        return self.local.summaries() + self.cloud.summaries() + [
+            f"Cascade: {local} of {total} images resolved by Ollama ({self.counts['accepted']} accepted, {self.counts['rejected']} rejected), {self.counts['escalated']} sent to {self.cloud.name}.",
+            f"Cascade: {avoided} of cloud requests avoided, about ${local * self.cost_per_image:.2f} saved at ${self.cost_per_image:g} per image."]
+def build_cascade_provider(params, log_callback, cache, preprocessor, pool_size=4, metrics=None):
+    focus_keyword = params['focus_keyword']
+    cloud_provider = params['cascade_provider']
+    accept = params.get('cascade_accept', params.get('threshold', 8))
+    reject = params.get('cascade_reject', 3)
+    if reject >= accept: raise ValueError(f"The cascade reject band ({reject}) must be below the accept band ({accept}).")
+    if params.get('mode', 'confidence') != 'confidence': log_callback("Warning: The cascade needs a confidence score, switching Ollama to 'confidence' mode.")
+    local = build_provider(dict(params, provider='ollama', mode='confidence', cascade_provider=None), log_callback, cache, preprocessor, pool_size, metrics)
+    cloud = build_provider(dict(params, provider=cloud_provider, cascade_provider=None), log_callback, cache, preprocessor, pool_size, metrics)
+    generation = ollama_generation_options(params)
+    def classify(image_path, image_data=None):
+        image_data = _load_for_request(image_path, image_data, preprocessor, log_callback)
+        if not image_data: return None
+        # Clear cached scores and cached cloud verdicts were settled by cached_result() before the image was loaded;
+        # an uncertain cached score still spares the Ollama request. Only live decisions feed the tier counts.
+        _, score = _cache_lookup(cache, image_path, local.cache_fields, log_callback)
+        live = score is None
+        if live: score = process_with_ollama(image_path, focus_keyword, params['model_name'], 'confidence', None, params['prompt_mode'], params['temperature'], log_callback, cache, preprocessor, image_data, local.session, local.limiter, generation, return_score=True, pool=local.pool)
+        if score == "STOP": return score
+        if score is not None and score >= accept:
+            if live: cascade.count('accepted')
+            return image_path
+        if score is not None and score <= reject:
+            if live: cascade.count('rejected')
+            return None
+        # Uncertain (or unreadable) local scores are settled by the cloud model.
+        cascade.count('escalated')
+        return cloud.classify(image_path, image_data)
+    cascade = CascadeProvider(local, cloud, classify, params.get('cloud_cost_per_image', CLOUD_COST_PER_IMAGE.get(cloud_provider, 0.001)), accept, reject)
+    log_callback(f"Cascade: Ollama accepts scores >= {accept} and rejects scores <= {reject}; {cloud.name} decides the rest.")
+    return cascade
+def build_provider(params, log_callback, cache, preprocessor, pool_size=4, metrics=None):
     focus_keyword = params['focus_keyword']
     provider = params['provider']
+    if provider == 'ollama' and params.get('cascade_provider'): return build_cascade_provider(params, log_callback, cache, preprocessor, pool_size, metrics)
+    session = create_http_session(pool_size, metrics)
+    limiter = create_limiter(params, provider, pool_size)
+    if provider == 'google':
+        # 'api_base_url' points a cloud provider at a proxy or a local stand-in server (scheme and host only).
+        api_base = params.get('api_base_url') or GOOGLE_API_BASE
+        def classify(image_path, image_data=None):
+            return process_with_google(image_path, focus_keyword, params['api_key'], params['debug_mode'], log_callback, cache, preprocessor, image_data, session, limiter, api_base)
+        build_request = lambda image_data: _google_request(focus_keyword, params['api_key'], *image_data, api_base=api_base)
+        stats = BatchStats('Google')
+        classify_batch = _batch_classifier(lambda items: process_batch_with_google(items, focus_keyword, params['api_key'], log_callback, cache, session, limiter, stats, api_base), classify, stats)
+        return ScanProvider('Google', classify, ('google', GOOGLE_MODEL_NAME, 'yesno', None, focus_keyword), None, build_request, lambda result: _google_verdict(result, focus_keyword), 90, session, limiter, focus_keyword=focus_keyword, classify_batch=classify_batch, batch_stats=stats)
+    if provider in ('chatgpt', 'deepseek'):
+        api_base, model_name, provider_name = {
+            'chatgpt': ("https://api.openai.com", "gpt-4o", "ChatGPT"),
+            'deepseek': ("https://api.deepseek.com", "deepseek-vl-chat", "DeepSeek"),
+        }[provider]
+        api_url = f"{params.get('api_base_url') or api_base}/v1/chat/completions"
+        def classify(image_path, image_data=None):
+            return process_with_openai_compatible(image_path, focus_keyword, params['api_key'], params['debug_mode'], api_url=api_url, model_name=model_name, provider_name=provider_name, log_callback=log_callback, cache=cache, preprocessor=preprocessor, image_data=image_data, session=session, limiter=limiter)
+        build_request = lambda image_data: (api_url, *_openai_request(focus_keyword, params['api_key'], model_name, *image_data))
+        stats = BatchStats(provider_name)
+        classify_batch = _batch_classifier(lambda items: process_batch_with_openai_compatible(items, focus_keyword, params['api_key'], api_url, model_name, provider_name, log_callback, cache, session, limiter, stats), classify, stats)
+        return ScanProvider(provider_name, classify, (provider_name.lower(), model_name, 'yesno', None, focus_keyword), None, build_request, lambda result: _openai_verdict(result, focus_keyword), 90, session, limiter, focus_keyword=focus_keyword, classify_batch=classify_batch, batch_stats=stats)
+    if provider == 'ollama':
+        mode = params['mode']
+        generation = ollama_generation_options(params)
+        pool = create_ollama_pool(params, log_callback)
+        def classify(image_path, image_data=None):
+            return process_with_ollama(image_path, focus_keyword, params['model_name'], mode, params['threshold'], params['prompt_mode'], params['temperature'], log_callback, cache, preprocessor, image_data, session, limiter, generation, pool=pool)
+        # The asyncio engine reads whole responses, so it keeps the generation limits but not streaming.
+        async_generation = dict(generation, stream=False)
+        # Only single-endpoint pools reach the asyncio engine; find_images_logic keeps several hosts on the thread engine.
+        build_request = lambda image_data: (f"{pool.endpoints[0].url}/api/generate", {}, _ollama_request(focus_keyword, params['model_name'], mode, params['prompt_mode'], params['temperature'], image_data[0], async_generation))
+        parse_verdict = lambda result: _ollama_verdict(result["response"], mode, focus_keyword, params['threshold'])
+        threshold = params['threshold'] if mode == 'confidence' else None
+        return ScanProvider('Ollama', classify, ('ollama', params['model_name'], _ollama_cache_mode(mode, params['prompt_mode'], focus_keyword, params['threshold']), params['temperature'], focus_keyword), threshold, build_request, parse_verdict, 180, session, limiter, stop_on_connection_error=True, focus_keyword=focus_keyword, pool=pool)
+    session.close()
+    raise ValueError(f"Unknown provider '{provider}'.")
+
+# --- asyncio inference engine: one event loop keeps many requests in flight without a thread each ---
+async def _post_with_retry_async(http, provider, api_url, headers, payload, log_callback, max_retries=5):
+    limiter = provider.limiter
+    body = StreamingJSONBody(payload)
+    headers = dict(headers, **{'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+    metrics = getattr(provider.session, 'metrics', None)
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            while True:
+                wait = limiter.try_acquire()
+                if not wait: break
+                await asyncio.sleep(min(wait, 1.0))
+        started = time.monotonic()
+        body.sent_at = None
+        try:
+            async with http.post(api_url, headers=headers, data=_async_body(body), timeout=aiohttp.ClientTimeout(total=provider.timeout)) as response:
+                headers_at = time.monotonic()
+                status, retry_after = response.status, _parse_retry_after(response.headers.get('Retry-After'))
+                result = await response.json(content_type=None) if status == 200 else None
+            if metrics is not None: metrics.observe_request(provider.name, status, started, body.sent_at, headers_at, time.monotonic(), attempt > 0, len(body) if body.sent_at is not None else 0)
+        except asyncio.TimeoutError:
+            if metrics is not None: metrics.observe_request(provider.name, 'timeout', started, retry=attempt > 0)
+            if limiter is not None: limiter.release(throttled=True)
+            if attempt == max_retries: raise
+            delay = _retry_delay(attempt)
+            log_callback(f"Warning ({provider.name}): Request timed out, retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException as e:
+            # Also reached when the task is cancelled, which must free the slot too.
+            if limiter is not None: limiter.release(failed=isinstance(e, aiohttp.ClientConnectionError))
+            raise
+        throttled = status in RETRYABLE_STATUS_CODES
+        if limiter is not None: limiter.release(time.monotonic() - started if status < 400 else None, throttled)
+        if not throttled: return status, result
+        if retry_after is not None and limiter is not None: limiter.pause(retry_after)
+        if attempt == max_retries:
+            if status == 429: raise QuotaExceededError(f"{provider.name} quota still exhausted after {max_retries} retries")
+            return status, None
+        delay = _retry_delay(attempt, retry_after)
+        log_callback(f"Warning ({provider.name}): Status {status}, retrying in {delay:.1f}s.")
+        await asyncio.sleep(delay)
+async def _classify_async(http, provider, image_path, image_data, cache, log_callback):
+    api_url, headers, payload = provider.build_request(image_data)
+    try:
+        status, result = await _post_with_retry_async(http, provider, api_url, headers, payload, log_callback)
+        if status != 200:
+            # A bad status comes from a live server and only concerns this image; connection errors stop the scan below.
+            log_callback(f"Error ({provider.name}) with {os.path.basename(image_path)}: Bad status {status}.")
+            _note_image_error(provider.session, image_path)
+            return None
+        started = time.monotonic()
+        _record_usage(provider.limiter, result)
+        verdict = provider.parse_verdict(result)
+        _observe_since(provider.session, 'parse', started)
+    except aiohttp.ClientConnectionError:
+        if not provider.stop_on_connection_error: raise
+        log_callback(f"Error: Could not connect to {provider.name} server. Is it running?")
+        return "STOP"
+    if verdict is None:
+        _note_image_error(provider.session, image_path)
+        return None
+    if cache is not None:
+        cache_key, _ = _cache_lookup(cache, image_path, provider.cache_fields, log_callback, lookup=False)
+        _cache_store(cache, cache_key, verdict)
+    return _verdict_result(image_path, verdict, provider.threshold, provider.focus_keyword)
+async def _async_inference_main(provider, job_queue, result_queue, concurrency, halt_event, cache, log_callback, state):
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    async def run_one(image_path, image_data):
+        try:
+            result = await _classify_async(http, provider, image_path, image_data, cache, log_callback)
+        except asyncio.CancelledError:
+            slots.release()
+            result_queue.put((image_path, "CANCELLED"))
+            return
+        except QuotaExceededError as e:
+            log_callback(f"Error ({provider.name}) with {os.path.basename(image_path)}: {e}")
+            result = "FAILED"
+        except Exception as e:
+            log_callback(f"Error ({provider.name}) with {os.path.basename(image_path)}: {e}")
+            _note_image_error(provider.session, image_path)
+            result = None
+        slots.release()
+        await loop.run_in_executor(None, result_queue.put, (image_path, result))
+    async def cancel_on_halt():
+        while not halt_event.is_set(): await asyncio.sleep(0.1)
+        for task in list(tasks): task.cancel()
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        watcher = asyncio.create_task(cancel_on_halt())
+        while True:
+            await slots.acquire()
+            item = await loop.run_in_executor(None, job_queue.get)
+            if item is _PIPELINE_DONE or halt_event.is_set():
+                slots.release()
+                if item is _PIPELINE_DONE:
+                    state['inputs_done'] = True
+                    break
+                continue
+            task = asyncio.create_task(run_one(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks: await asyncio.gather(*tasks)
+        watcher.cancel()
+def run_async_inference(provider, job_queue, result_queue, concurrency, halt_event, cache, log_callback):
+    state = {'inputs_done': False}
+    try:
+        asyncio.run(_async_inference_main(provider, job_queue, result_queue, concurrency, halt_event, cache, log_callback, state))
+    except Exception as e:
+        log_callback(f"A critical error occurred in the asyncio engine: {e}")
+        halt_event.set()
+        while not state['inputs_done']: state['inputs_done'] = job_queue.get() is _PIPELINE_DONE
+    finally:
+        result_queue.put(_PIPELINE_DONE)
+
+def find_images_logic(params, progress_callback, log_callback, stop_event, result_callback=None):
+    roots = params.get('directories') or [params['directory']]
+    keywords = params.get('focus_keywords') or [params['focus_keyword']]
+    # Several keywords are answered together in one request per image; a single keyword keeps the plain prompts.
+    focus_keyword = keywords[0] if len(keywords) == 1 else list(keywords)
+    params = dict(params, focus_keyword=focus_keyword)
+    provider = params['provider']
     recursive_scan = params.get('recursive', True)
+    ollama_hosts = len(params.get('ollama_hosts') or [OLLAMA_BASE_URL])
+    max_workers = params.get('max_workers') or (sum(endpoint.limit for endpoint in parse_ollama_hosts(params)) if provider == 'ollama' else 16)
+    io_workers = params.get('io_workers', 2)
+    use_asyncio = params.get('engine', 'threads') == 'asyncio'
+    if use_asyncio and provider == 'ollama' and (ollama_hosts > 1 or params.get('hedge_after') is not None):
+        log_callback("Warning: Spreading requests over several Ollama endpoints needs the thread engine, using it.")
+        use_asyncio = False
+    if _is_multi(focus_keyword) and params.get('cascade_provider'):
+        log_callback("Warning: The cascade works on a single keyword's score, asking Ollama alone for all keywords.")
+        params['cascade_provider'] = None
+    if use_asyncio and params.get('cascade_provider') and provider == 'ollama':
+        log_callback("Warning: The cascade makes up to two requests per image, using the thread engine.")
+        use_asyncio = False
+    if use_asyncio and aiohttp is None:
+        log_callback("Warning: aiohttp is not installed, falling back to the thread engine.")
+        use_asyncio = False
+    batch_size = max(1, params.get('batch_size') or 1) if provider != 'ollama' else 1
+    if use_asyncio and batch_size > 1:
+        log_callback("Warning: Packing several images per request uses the thread engine.")
+        use_asyncio = False
+    in_flight = params.get('async_concurrency', 64) if use_asyncio else max_workers
+    watch = params.get('watch', False)
+    destination_folder = params.get('destination_folder')
+    action = params.get('action')
     log_callback("Gathering image files...")
-    supported_extensions = ('.png', '.jpg', '.jpeg', '.webp', '.cr2', '.dng', '.tiff')
-    image_list = []
+    for root in roots:
+        if not os.path.isdir(root): log_callback(f"Warning: '{root}' is not a directory, skipping it.")
+    # A watch always keeps its handled files in the manifest, so a restart classifies what arrived in between.
+    manifest = open_manifest(dict(params, use_manifest=True) if watch else params, log_callback)
+    if manifest is not None and params.get('delta_only'):
+        log_callback("Delta scan: only images added or modified since the last completed scan will be analyzed.")
     if recursive_scan:
         log_callback("Recursive scan enabled: Searching in subdirectories...")
-        for dirpath, _, filenames in os.walk(directory):
-            for filename in filenames:
-                if filename.lower().endswith(supported_extensions):
-                    full_path = os.path.join(dirpath, filename)
-                    image_list.append(full_path)
     else:
         log_callback("Recursive scan disabled: Searching in top-level directory only.")
-        for filename in os.listdir(directory):
-             if filename.lower().endswith(supported_extensions):
-                full_path = os.path.join(directory, filename)
-                if os.path.isfile(full_path): image_list.append(full_path)
-    log_callback(f"Found {len(image_list)} images to analyze.")
-    if not image_list:
-        log_callback("Warning: No compatible images found.")
-        return {}
-    log_callback(f"Starting analysis using '{provider}' for '{focus_keyword}'...")
+    log_callback(f"Starting analysis using '{provider}' for '{_keyword_label(focus_keyword)}'...")
     found_images = {}
-    args_list = []
-    if provider == 'google':
-        target_func = process_with_google
-        args_list = [(img, focus_keyword, params['api_key'], params['debug_mode'], log_callback) for img in image_list]
-    elif provider == 'chatgpt':
-        def worker_chatgpt(image_path, focus_keyword, api_key, debug_mode):
-            return process_with_openai_compatible(image_path, focus_keyword, api_key, debug_mode, api_url="https://api.openai.com/v1/chat/completions", model_name="gpt-4o", provider_name="ChatGPT", log_callback=log_callback)
-        target_func = worker_chatgpt
-        args_list = [(img, focus_keyword, params['api_key'], params['debug_mode']) for img in image_list]
-    elif provider == 'deepseek':
-        def worker_deepseek(image_path, focus_keyword, api_key, debug_mode):
-             return process_with_openai_compatible(image_path, focus_keyword, api_key, debug_mode, api_url="https://api.deepseek.com/v1/chat/completions", model_name="deepseek-vl-chat", provider_name="DeepSeek", log_callback=log_callback)
-        target_func = worker_deepseek
-        args_list = [(img, focus_keyword, params['api_key'], params['debug_mode']) for img in image_list]
-    elif provider == 'ollama':
-        target_func = process_with_ollama
-        args_list = [(img, focus_keyword, params['model_name'], params['mode'], params['threshold'], params['prompt_mode'], params['temperature'], log_callback) for img in image_list]
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {executor.submit(target_func, *args): args[0] for args in args_list}
-        processed_count = 0
-        for future in as_completed(futures):
-            if stop_event.is_set(): break
-            result_path = future.result()
+    cache = open_verdict_cache(params, log_callback)
+    metrics = create_scan_metrics(params)
+    preprocessor = create_preprocessor(params, log_callback, metrics)
+    clusters = create_duplicate_clusters(params, log_callback)
+    provider_client = build_provider(params, log_callback, cache, preprocessor, pool_size=in_flight, metrics=metrics)
+    if provider == 'ollama' and params.get('warm_up', True):
+        provider_client.pool.warm_up(params['model_name'], ollama_generation_options(params)['keep_alive'], log_callback, provider_client.session)
+    # Bounded queues keep memory flat: at most a few encoded images are held while inference runs.
+    path_queue = queue.Queue(maxsize=params.get('queue_size', 1024))
+    job_queue = queue.Queue(maxsize=in_flight * 2)
+    result_queue = queue.Queue(maxsize=params.get('queue_size', 1024))
+    halt_event = threading.Event()
+    discovered = [0]
+    # Matches are routed as soon as they are confirmed; without partial output they must wait for the scan to finish.
+    router = None
+    if destination_folder and (watch or params.get('process_partial_results', True)):
+        router = create_file_router(params, roots, log_callback)
+        log_callback(f"Matches will be sent to {destination_folder} ({router.action}) as soon as they are found.")
+    def discover():
+        try:
+            if params.get('paths') is not None:
+                source = iter(params['paths'])
+            elif watch:
+                source = watch_new_images(roots, recursive_scan, halt_event, params.get('settle_seconds', 2.0), params.get('poll_interval', 5.0), params.get('watch_existing', False), [destination_folder], params.get('use_inotify', True), log_callback, manifest)
+            else:
+                source = enumerate_images(roots, recursive_scan, params.get('scan_workers', 8), manifest, params.get('delta_only', False), threading.Event(), params.get('verify_files', False))
+            for image_path in source:
+                if halt_event.is_set(): break
+                discovered[0] += 1
+                path_queue.put((image_path,))
+        except Exception as e:
+            log_callback(f"Error while gathering image files: {e}")
+        finally:
+            log_callback(f"Watch ended after {discovered[0]} new images." if watch else f"Found {discovered[0]} images to analyze.")
+            for _ in range(io_workers): path_queue.put(_PIPELINE_DONE)
+    load_started = {}
+    # Images left without a verdict (read errors, failed requests, exhausted quota) stay out of the manifest.
+    unsettled = set()
+    def load(item):
+        image_path = item[0]
+        if metrics is not None: load_started[image_path] = time.monotonic()
+        hit, cached = provider_client.cached_result(cache, image_path, log_callback)
+        if hit:
+            result_queue.put((image_path, cached))
+            return
+        if clusters is not None:
+            try:
+                representative, known, verdict = clusters.assign(image_path, perceptual_hash(image_path))
+            except Exception:
+                representative = None
+            if representative is not None:
+                if known: result_queue.put((image_path, _copy_verdict(verdict, image_path)))
+                return
+        started = time.monotonic()
+        try:
+            image_data = get_image_data(image_path, preprocessor, metrics)
+        except IOError as e:
+            log_callback(f"Error reading file {os.path.basename(image_path)}: {e}")
+            unsettled.add(image_path)
+            result_queue.put((image_path, None))
+            return
+        if metrics is not None: metrics.observe('load', time.monotonic() - started)
+        if not image_data[0]:
+            unsettled.add(image_path)
+            result_queue.put((image_path, None))
+            return
+        job_queue.put((image_path, image_data))
+    def infer(item):
+        result_queue.put((item[0], provider_client.classify(item[0], item[1])))
+    def infer_batch(items):
+        for (image_path, _), result in zip(items, provider_client.classify_batch(items)): result_queue.put((image_path, result))
+    def on_error(item, error):
+        if isinstance(error, ScanCancelledError):
+            result_queue.put((item[0], "CANCELLED"))
+            return
+        log_callback(f"Error processing {os.path.basename(item[0])}: {error}")
+        unsettled.add(item[0])
+        result_queue.put((item[0], "FAILED" if isinstance(error, QuotaExceededError) else None))
+    def halt():
+        # Cancels queued work (every stage skips items once halted) and aborts requests already on the wire.
+        if halt_event.is_set(): return
+        halt_event.set()
+        provider_client.abort()
+    processed_count = 0
+    failed_count = 0
+    scan_completed = False
+    def record(image_path, result_path, errored=False):
+        nonlocal processed_count, failed_count
+        if result_path == "FAILED":
+            failed_count += 1
+        elif result_path:
+            found_images[result_path] = getattr(result_path, 'keywords', [focus_keyword])
+            if router is not None: router.submit(result_path, _keyword_folders(result_path))
+        # 'error' marks images that got no verdict at all (unreachable provider, bad status, unreadable file).
+        outcome = 'failed' if result_path == "FAILED" else 'match' if result_path else 'error' if errored else 'no_match'
+        if metrics is not None:
+            metrics.count_image(outcome)
+            started = load_started.pop(image_path, None)
+            if started is not None: metrics.observe('total', time.monotonic() - started)
+        if watch and manifest is not None and outcome in ('match', 'no_match'):
+            signature = _file_signature(image_path)
+            if signature is not None: manifest.mark_handled([(image_path, signature)])
+        if result_callback:
+            result_callback(image_path, outcome, found_images[result_path] if result_path and result_path != "FAILED" else [])
+        processed_count += 1
+    try:
+        threading.Thread(target=discover, daemon=True).start()
+        # Batches keep the same number of images in flight with fewer, larger requests.
+        inference_workers = -(-max_workers // batch_size)
+        _start_stage(io_workers, path_queue, job_queue, 1 if use_asyncio else inference_workers, load, halt_event, on_error)
+        if batch_size > 1:
+            log_callback(f"Packing up to {batch_size} images into each {provider_client.name} request.")
+            _start_batch_stage(inference_workers, job_queue, result_queue, 1, batch_size, infer_batch, halt_event, on_error)
+        elif use_asyncio:
+            log_callback(f"Using the asyncio engine with up to {in_flight} concurrent requests.")
+            threading.Thread(target=run_async_inference, args=(provider_client, job_queue, result_queue, in_flight, halt_event, cache, log_callback), daemon=True).start()
+        else:
+            _start_stage(max_workers, job_queue, result_queue, 1, infer, halt_event, on_error)
+        # A long-running watch keeps its metric files fresh for scrapers instead of writing them only at exit.
+        next_export = time.monotonic() + params.get('metrics_interval', 30.0)
+        while True:
+            if watch and metrics is not None and time.monotonic() >= next_export:
+                export_scan_metrics(metrics, params, log_callback, quiet=True)
+                next_export = time.monotonic() + params.get('metrics_interval', 30.0)
+            try:
+                item = result_queue.get(timeout=0.25)
+            except queue.Empty:
+                if stop_event.is_set(): halt()
+                continue
+            if item is _PIPELINE_DONE:
+                scan_completed = not halt_event.is_set()
+                break
+            if stop_event.is_set(): halt()
+            if halt_event.is_set(): continue
+            result_path = item[1]
             if result_path == "STOP":
                 log_callback("Stopping analysis due to connection error.")
-                break
-            if result_path: found_images[result_path] = [focus_keyword]
-            processed_count += 1
-            progress = (processed_count / len(image_list)) * 100
-            progress_callback(progress)
+                halt()
+                if result_callback: result_callback(item[0], 'stopped', [])
+                continue
+            errored = result_path == "FAILED" or item[0] in unsettled or provider_client.image_failed(item[0])
+            if errored: unsettled.add(item[0])
+            record(item[0], result_path, errored)
+            if clusters is not None:
+                for duplicate_path in clusters.resolve(item[0], result_path):
+                    if errored: unsettled.add(duplicate_path)
+                    record(duplicate_path, _copy_verdict(result_path, duplicate_path), errored)
+            progress_callback((processed_count / max(discovered[0], processed_count)) * 100)
+    finally:
+        halt_event.set()
+        provider_client.close()
+        if router is not None:
+            router.close()
+            log_callback(router.summary())
+        for line in provider_client.summaries(): log_callback(line)
+        if metrics is not None:
+            metrics.finished = time.time()
+            for line in metrics.summary(): log_callback(line)
+            export_scan_metrics(metrics, params, log_callback)
+        if preprocessor is not None and preprocessor.images:
+            log_callback(preprocessor.summary())
+        if clusters is not None:
+            log_callback(clusters.summary())
+        if cache is not None:
+            log_callback(f"Result cache: {cache.hits} hits, {cache.misses} misses.")
+            cache.close()
+        if manifest is not None:
+            if not watch: log_callback(manifest.summary())
+            if scan_completed and unsettled: manifest.forget(unsettled)
+            manifest.close(commit=scan_completed)
+    if not discovered[0]:
+        log_callback("No new images arrived while watching." if watch else "Warning: No compatible images found.")
+        return {}
+    if failed_count:
+        log_callback(f"Warning: {failed_count} images could not be classified because the provider quota stayed exhausted. Re-run the scan to retry them.")
     if stop_event.is_set():
         log_callback("\nScan stopped by user.")
     if found_images:
-        log_callback(f"\n--- Found {len(found_images)} images where '{focus_keyword}' is the main subject ---")
-        for path in found_images: log_callback(f"  - {os.path.basename(path)}")
+        log_callback(f"\n--- Found {len(found_images)} images where '{_keyword_label(focus_keyword)}' is the main subject ---")
+        for path, matched in found_images.items(): log_callback(f"  - {os.path.basename(path)}" + (f" ({', '.join(matched)})" if _is_multi(focus_keyword) else ""))
+        if _is_multi(focus_keyword):
+            log_callback("Matches per keyword: " + ", ".join(f"{keyword}: {sum(keyword in matched for matched in found_images.values())}" for keyword in focus_keyword))
     else:
         if not stop_event.is_set():
-             log_callback(f"\nNo images were found where '{focus_keyword}' is the main subject.")
+             log_callback(f"\nNo images were found where '{_keyword_label(focus_keyword)}' is the main subject.")
     
-    destination_folder = params.get('destination_folder')
-    action = params.get('action')
-    if destination_folder and found_images:
-        process_output_files(list(found_images.keys()), destination_folder, action, log_callback)
+    if router is None and destination_folder and found_images and not stop_event.is_set():
+        process_output_files(list(found_images.keys()), destination_folder, action, log_callback, params.get('output_layout', 'flat'), roots, params.get('output_workers', 4))
     
     log_callback("\nScan Finished.")
+    return found_images
+# --- Offline caption/embedding index: describe each image once, answer later keyword queries from disk ---
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".aiimagescanner", "index")
+CAPTION_PROMPT = "Describe this image in one sentence. Name its main subject first, then the setting."
+class ImageIndex:
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self._conn = sqlite3.connect(os.path.join(index_dir, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS images (row INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime_ns INTEGER, caption TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+        self.meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        self.dim = int(self.meta.get('dim', 0))
+        self.rows = {row[1]: (row[0], row[2], row[3]) for row in self._conn.execute("SELECT row, path, size, mtime_ns FROM images")}
+        self._vectors = open(self.vectors_path, 'r+b' if os.path.exists(self.vectors_path) else 'w+b')
+        # Vectors are written before their row is committed, so a killed build can leave rows the table never got.
+        if self.dim and os.path.getsize(self.vectors_path) > len(self.rows) * self.dim * 4: self._vectors.truncate(len(self.rows) * self.dim * 4)
+    def configure(self, embed_model):
+        # Vectors from different embedding models live in different spaces, so switching models starts over.
+        if self.meta.get('embed_model') == (embed_model or ''): return False
+        changed = bool(self.rows)
+        self._reset(embed_model)
+        return changed
+    def _reset(self, embed_model):
+        with self._lock:
+            self._conn.execute("DELETE FROM images")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.execute("INSERT INTO meta VALUES ('embed_model', ?), ('dim', '0')", (embed_model or '',))
+            self._conn.commit()
+            self._vectors.truncate(0)
+            self.meta, self.dim, self.rows = {'embed_model': embed_model or '', 'dim': '0'}, 0, {}
+    def is_current(self, image_path, size, mtime_ns):
+        known = self.rows.get(image_path)
+        return known is not None and known[1] == size and known[2] == mtime_ns
+    def add(self, image_path, size, mtime_ns, caption, vector=None):
+        with self._lock:
+            row = self.rows[image_path][0] if image_path in self.rows else len(self.rows)
+            if vector is not None:
+                vector = np.asarray(vector, dtype=np.float32)
+                if not self.dim:
+                    self.dim = len(vector)
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(self.dim),))
+                if len(vector) != self.dim: raise ValueError(f"Embedding has {len(vector)} dimensions, the index has {self.dim}.")
+                # Rows are stored unit-length, so a query is a single matrix-vector product.
+                norm = float(np.linalg.norm(vector))
+                self._vectors.seek(row * self.dim * 4)
+                self._vectors.write((vector / norm if norm else vector).tobytes())
+            self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)", (row, image_path, size, mtime_ns, caption))
+            self.rows[image_path] = (row, size, mtime_ns)
+            self._pending_writes += 1
+            if self._pending_writes >= 200:
+                self._vectors.flush()
+                self._conn.commit()
+                self._pending_writes = 0
+    def entries(self):
+        with self._lock:
+            return self._conn.execute("SELECT path, caption FROM images ORDER BY row").fetchall()
+    def matrix(self):
+        self._vectors.flush()
+        count = os.path.getsize(self.vectors_path) // (self.dim * 4) if self.dim else 0
+        if not count: return None
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(count, self.dim))
+    def close(self):
+        with self._lock:
+            self._vectors.close()
+            self._conn.commit()
+            self._conn.close()
+def _ollama_caption(session, limiter, model_name, base64_image, keep_alive, log_callback, pool=None):
+    payload = {"model": model_name, "prompt": CAPTION_PROMPT, "stream": False, "images": [base64_image], "options": {"temperature": 0.0, "num_predict": 60}, "keep_alive": keep_alive}
+    def request(base_url):
+        response = post_with_retry(session, f"{base_url}/api/generate", limiter, log_callback, "Ollama", retry_timeouts=pool is None, json=payload, timeout=180)
+        response.raise_for_status()
+        return response.json()["response"].strip()
+    return pool.run(request, session.cancel_event, session) if pool is not None else request(OLLAMA_BASE_URL)
+def _ollama_embed(session, embed_model, text, log_callback, pool=None):
+    def request(base_url):
+        response = post_with_retry(session, f"{base_url}/api/embed", None, log_callback, "Ollama", retry_timeouts=pool is None, json={"model": embed_model, "input": text}, timeout=60)
+        response.raise_for_status()
+        return response.json()["embeddings"][0]
+    return pool.run(request, session.cancel_event, session) if pool is not None else request(OLLAMA_BASE_URL)
+def build_image_index(params, progress_callback, log_callback, stop_event, result_callback=None):
+    if np is None:
+        log_callback("Error: The image index needs NumPy (pip install numpy).")
+        return {}
+    roots = params.get('directories') or [params['directory']]
+    model_name = params['model_name']
+    embed_model = params.get('embed_model', 'nomic-embed-text')
+    pool = create_ollama_pool(params, log_callback)
+    max_workers = params.get('max_workers') or pool.capacity
+    io_workers = params.get('io_workers', 2)
+    keep_alive = params.get('keep_alive', '30m')
+    index = ImageIndex(params.get('index_dir') or DEFAULT_INDEX_DIR)
+    if index.configure(embed_model): log_callback(f"Embedding model changed to '{embed_model}', rebuilding the index.")
+    log_callback(f"Indexing images with '{model_name}'" + (f" and embedding captions with '{embed_model}'..." if embed_model else " (captions only)..."))
+    preprocessor = create_preprocessor(params, log_callback)
+    session = create_http_session(max_workers)
+    limiter = create_limiter(params, 'ollama', max_workers)
+    if params.get('warm_up', True): pool.warm_up(model_name, keep_alive, log_callback, session)
+    path_queue = queue.Queue(maxsize=params.get('queue_size', 1024))
+    job_queue = queue.Queue(maxsize=max_workers * 2)
+    result_queue = queue.Queue(maxsize=params.get('queue_size', 1024))
+    halt_event = threading.Event()
+    counts = {'discovered': 0, 'unchanged': 0, 'indexed': 0, 'failed': 0}
+    def discover():
+        try:
+            for image_path in enumerate_images(roots, params.get('recursive', True), params.get('scan_workers', 8)):
+                if halt_event.is_set(): break
+                signature = _file_signature(image_path)
+                if signature is None: continue
+                if index.is_current(image_path, signature[0], signature[1]):
+                    counts['unchanged'] += 1
+                    continue
+                counts['discovered'] += 1
+                path_queue.put((image_path, signature))
+        finally:
+            log_callback(f"Found {counts['discovered']} new or changed images to index ({counts['unchanged']} already indexed).")
+            for _ in range(io_workers): path_queue.put(_PIPELINE_DONE)
+    def load(item):
+        image_data = _load_for_request(item[0], None, preprocessor, log_callback)
+        if image_data: job_queue.put((item[0], item[1], image_data))
+        else: result_queue.put((item[0], item[1], None, None))
+    def infer(item):
+        caption = _ollama_caption(session, limiter, model_name, item[2][0], keep_alive, log_callback, pool)
+        vector = _ollama_embed(session, embed_model, caption, log_callback, pool) if embed_model else None
+        result_queue.put((item[0], item[1], caption, vector))
+    def on_error(item, error):
+        if isinstance(error, NoOllamaEndpointError) and not halt_event.is_set():
+            log_callback("Error: Could not connect to any Ollama endpoint. Are they running?" if len(pool.endpoints) > 1 else "Error: Could not connect to Ollama server. Is it running?")
+            halt_event.set()
+            abort_http_session(session)
+        elif not isinstance(error, ScanCancelledError):
+            log_callback(f"Error indexing {os.path.basename(item[0])}: {error}")
+        result_queue.put((item[0], item[1], None, None))
+    try:
+        threading.Thread(target=discover, daemon=True).start()
+        _start_stage(io_workers, path_queue, job_queue, max_workers, load, halt_event, on_error)
+        _start_stage(max_workers, job_queue, result_queue, 1, infer, halt_event, on_error)
+        while True:
+            try:
+                item = result_queue.get(timeout=0.25)
+            except queue.Empty:
+                if stop_event.is_set() and not halt_event.is_set():
+                    halt_event.set()
+                    abort_http_session(session)
+                continue
+            if item is _PIPELINE_DONE: break
+            image_path, signature, caption, vector = item
+            try:
+                if caption is None: raise ValueError("no caption")
+                index.add(image_path, signature[0], signature[1], caption, vector)
+                counts['indexed'] += 1
+                if result_callback: result_callback(image_path, 'indexed', [])
+            except (ValueError, OSError, sqlite3.Error) as e:
+                counts['failed'] += 1
+                if caption is not None: log_callback(f"Error indexing {os.path.basename(image_path)}: {e}")
+                if result_callback: result_callback(image_path, 'failed', [])
+            progress_callback((counts['indexed'] + counts['failed']) / max(counts['discovered'], 1) * 100)
+    finally:
+        halt_event.set()
+        pool.close()
+        session.close()
+        log_callback(limiter.summary())
+        if len(pool.endpoints) > 1: log_callback(pool.summary())
+        log_callback(f"Index: {counts['indexed']} images added, {counts['unchanged']} unchanged, {counts['failed']} failed; {len(index.rows)} images in {params.get('index_dir') or DEFAULT_INDEX_DIR}.")
+        index.close()
+    log_callback("\nScan stopped by user." if stop_event.is_set() else "\nIndexing Finished.")
+    return {}
+def _search_index(index, entries, keyword, query_vector, top_k, min_score, roots):
+    allowed = [_is_within(path, roots) for path, _ in entries]
+    matrix = index.matrix() if query_vector is not None else None
+    if matrix is not None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= float(np.linalg.norm(query)) or 1.0
+        scores = np.full(len(entries), -np.inf, dtype=np.float32)
+        matrix = matrix[:len(entries)]
+        scores[:len(matrix)] = matrix @ query
+        scores[~np.asarray(allowed, dtype=bool)] = -np.inf
+        top = np.argpartition(-scores, min(top_k, len(scores) - 1))[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(entries[row][0], float(scores[row]), entries[row][1]) for row in top if scores[row] > -np.inf and scores[row] >= min_score]
+    # Without embeddings, rank captions by how many of the keyword's words they mention.
+    words = [re.compile(rf"\b{re.escape(word)}s?\b", re.I) for word in keyword.split()]
+    ranked = []
+    for (path, caption), ok in zip(entries, allowed):
+        hits = sum(1 for word in words if word.search(caption or ''))
+        if ok and hits: ranked.append((path, hits / len(words), caption))
+    ranked.sort(key=lambda hit: -hit[1])
+    return ranked[:top_k]
+def search_image_index(params, progress_callback, log_callback, stop_event, result_callback=None):
+    if np is None:
+        log_callback("Error: The image index needs NumPy (pip install numpy).")
+        return {}
+    roots = [os.path.abspath(root) for root in (params.get('directories') or [params['directory']])]
+    keywords = params.get('focus_keywords') or [params['focus_keyword']]
+    index_dir = params.get('index_dir') or DEFAULT_INDEX_DIR
+    if not os.path.exists(os.path.join(index_dir, "index.sqlite3")):
+        log_callback(f"Error: No index found in {index_dir}. Build one first with --build-index.")
+        return {}
+    index = ImageIndex(index_dir)
+    embed_model = index.meta.get('embed_model') or None
+    use_vectors = params.get('query_mode', 'auto') != 'caption' and embed_model and index.dim
+    top_k, min_score = params.get('top_k', 20), params.get('min_score', 0.0)
+    started = time.monotonic()
+    hits = {}
+    session = create_http_session(1)
+    pool = create_ollama_pool(params, log_callback) if use_vectors else None
+    try:
+        entries = index.entries()
+        log_callback(f"Searching {len(entries)} indexed images by {'embedding similarity' if use_vectors else 'caption text'}...")
+        for keyword in keywords:
+            query_vector = None
+            if use_vectors:
+                try:
+                    query_vector = _ollama_embed(session, embed_model, f"A photo whose main subject is {keyword}.", log_callback, pool)
+                except requests.exceptions.RequestException as e:
+                    log_callback(f"Warning: Could not embed '{keyword}' ({e}), matching captions instead.")
+            for path, score, caption in _search_index(index, entries, keyword, query_vector, top_k, min_score, roots):
+                hits.setdefault(path, []).append(keyword)
+                log_callback(f"  {score:.3f}  {os.path.basename(path)}: {caption}")
+    finally:
+        if pool is not None: pool.close()
+        session.close()
+        index.close()
+    log_callback(f"Index search took {(time.monotonic() - started) * 1000:.0f} ms, {len(hits)} candidate images.")
+    if params.get('verify') and hits:
+        # Only the top hits go through the model, with the usual cache, output and result reporting.
+        log_callback(f"Re-verifying the top hits with '{params['model_name']}'...")
+        return find_images_logic(dict(params, paths=list(hits), watch=False), progress_callback, log_callback, stop_event, result_callback)
+    found_images = {}
+    for path, matched in hits.items():
+        if not os.path.exists(path): continue
+        found_images[path] = matched
+        if result_callback: result_callback(path, 'match', matched)
+    progress_callback(100)
+    if params.get('destination_folder') and found_images:
+        process_output_files([KeywordMatch(path, matched) if len(keywords) > 1 else path for path, matched in found_images.items()], params['destination_folder'], params.get('action'), log_callback, params.get('output_layout', 'flat'), roots, params.get('output_workers', 4))
+    log_callback("\nScan Finished.")
+    return found_images
 # --- END OF CORE LOGIC FUNCTIONS ---
 
 
-class App(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("AI Image Scanner")
-        self.geometry("850x700")
-
-        sv_ttk.set_theme("dark")
-        self.stop_event = threading.Event()
-
-        # --- Variables ---
-        self.dir_var = tk.StringVar()
-        self.focus_var = tk.StringVar()
-        self.destination_dir_var = tk.StringVar()
-        self.recursive_var = tk.BooleanVar(value=True)
-        self.action_var = tk.StringVar(value='copy') # ### <<< משתנה חדש לבחירה
-        self.provider_var = tk.StringVar(value='ollama')
-        self.api_key_var = tk.StringVar()
-        self.debug_var = tk.BooleanVar(value=False)
-        self.model_var = tk.StringVar(value='llava')
-        self.mode_var = tk.StringVar(value='confidence')
-        self.prompt_mode_var = tk.StringVar(value='simple')
-        self.threshold_var = tk.IntVar(value=8)
-        self.temp_var = tk.DoubleVar(value=0.1)
-
-        self.api_key_var.set(os.getenv("GEMINI_API_KEY", "") or os.getenv("OPENAI_API_KEY", "") or os.getenv("DEEPSEEK_API_KEY", ""))
-
-        # --- Layout ---
-        main_frame = ttk.Frame(self, padding="10")
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        main_frame.rowconfigure(3, weight=1) 
-        main_frame.columnconfigure(0, weight=1)
-        input_frame = ttk.LabelFrame(main_frame, text="Scan Settings", padding=15)
-        input_frame.grid(row=0, column=0, sticky="ew", pady=(0, 10))
-        input_frame.columnconfigure(1, weight=1)
-        self.ollama_frame = ttk.LabelFrame(main_frame, text="Ollama Options", padding=15)
-        self.ollama_frame.grid(row=1, column=0, sticky="ew", pady=10)
-        self.ollama_frame.columnconfigure((1, 3), weight=1)
-        output_frame = ttk.LabelFrame(main_frame, text="Output Log", padding=15)
-        output_frame.grid(row=3, column=0, sticky="nsew", pady=10)
-        output_frame.rowconfigure(0, weight=1)
-        output_frame.columnconfigure(0, weight=1)
-        bottom_frame = ttk.Frame(main_frame)
-        bottom_frame.grid(row=4, column=0, sticky="ew", pady=(10, 0))
-        bottom_frame.columnconfigure(0, weight=1)
-
-        # --- Widgets for Input Frame ---
-        ttk.Label(input_frame, text="Image Directory:").grid(row=0, column=0, sticky=tk.E, padx=10, pady=5)
-        ttk.Entry(input_frame, textvariable=self.dir_var).grid(row=0, column=1, sticky=tk.EW, pady=5)
-        ttk.Button(input_frame, text="Browse...", command=self.select_dir).grid(row=0, column=2, padx=10, pady=5)
-        ttk.Checkbutton(input_frame, text="Scan subdirectories", variable=self.recursive_var).grid(row=1, column=1, sticky=tk.W, padx=10, pady=5)
-        ttk.Label(input_frame, text="Keyword:").grid(row=2, column=0, sticky=tk.E, padx=10, pady=5)
-        ttk.Entry(input_frame, textvariable=self.focus_var).grid(row=2, column=1, columnspan=2, sticky=tk.EW, padx=10, pady=5)
-        
-        # ### <<< שינוי טקסט וארגון מחדש
-        ttk.Label(input_frame, text="Destination Folder (Optional):").grid(row=3, column=0, sticky=tk.E, padx=10, pady=5)
-        ttk.Entry(input_frame, textvariable=self.destination_dir_var).grid(row=3, column=1, sticky=tk.EW, pady=5)
-        ttk.Button(input_frame, text="Browse...", command=self.select_destination_dir).grid(row=3, column=2, padx=10, pady=5)
-        
-        action_frame = ttk.Frame(input_frame)
-        action_frame.grid(row=4, column=1, sticky=tk.W, padx=10, pady=5)
-        ttk.Radiobutton(action_frame, text="Copy Files", variable=self.action_var, value="copy").pack(side=tk.LEFT, padx=(0,10))
-        ttk.Radiobutton(action_frame, text="Move Files", variable=self.action_var, value="move").pack(side=tk.LEFT)
-        
-        ttk.Label(input_frame, text="Provider:").grid(row=5, column=0, sticky=tk.E, padx=10, pady=5)
-        provider_frame = ttk.Frame(input_frame)
-        provider_frame.grid(row=5, column=1, columnspan=2, sticky=tk.EW, pady=5)
-        provider_menu = ttk.Combobox(provider_frame, textvariable=self.provider_var, values=['ollama', 'google', 'chatgpt', 'deepseek'], state="readonly")
-        provider_menu.pack(side=tk.LEFT, padx=(10,0))
-        provider_menu.bind("<<ComboboxSelected>>", self.toggle_ollama_options)
-        instructions_button = ttk.Button(provider_frame, text="Local AI Instructions", command=self.show_local_ai_instructions)
-        instructions_button.pack(side=tk.LEFT, padx=10)
-        self.api_key_label = ttk.Label(input_frame, text="API Key:")
-        self.api_key_label.grid(row=6, column=0, sticky=tk.E, padx=10, pady=5)
-        self.api_key_entry = ttk.Entry(input_frame, textvariable=self.api_key_var, show="*")
-        self.api_key_entry.grid(row=6, column=1, columnspan=2, sticky=tk.EW, padx=10, pady=5)
-        ttk.Checkbutton(input_frame, text="Enable Debug Mode", variable=self.debug_var).grid(row=7, column=1, sticky=tk.W, padx=10, pady=5)
-
-        # --- Widgets for Ollama Frame and others are unchanged ---
-        ttk.Label(self.ollama_frame, text="Model:").grid(row=0, column=0, sticky=tk.E, padx=10, pady=5)
-        ttk.Entry(self.ollama_frame, textvariable=self.model_var).grid(row=0, column=1, sticky=tk.EW, padx=10, pady=5)
-        ttk.Label(self.ollama_frame, text="Temperature:").grid(row=0, column=2, sticky=tk.E, padx=10, pady=5)
-        self.temp_spinbox = ttk.Spinbox(self.ollama_frame, from_=0.0, to=2.0, increment=0.1, textvariable=self.temp_var, width=10)
-        self.temp_spinbox.grid(row=0, column=3, sticky=tk.W, padx=10, pady=5)
-        ttk.Label(self.ollama_frame, text="Analysis Mode:").grid(row=1, column=0, sticky=tk.E, padx=10, pady=5)
-        self.mode_menu = ttk.Combobox(self.ollama_frame, textvariable=self.mode_var, values=['confidence', 'yesno'], state="readonly")
-        self.mode_menu.grid(row=1, column=1, sticky=tk.EW, padx=10, pady=5)
-        self.mode_menu.bind("<<ComboboxSelected>>", self.update_ollama_options_state)
-        self.prompt_mode_label = ttk.Label(self.ollama_frame, text="Prompt Mode ('yesno'):")
-        self.prompt_mode_label.grid(row=2, column=0, sticky=tk.E, padx=10, pady=5)
-        self.prompt_mode_combo = ttk.Combobox(self.ollama_frame, textvariable=self.prompt_mode_var, values=['simple', 'cot'], state="readonly")
-        self.prompt_mode_combo.grid(row=2, column=1, sticky=tk.EW, padx=10, pady=5)
-        self.threshold_label = ttk.Label(self.ollama_frame, text="Threshold ('confidence'):")
-        self.threshold_label.grid(row=2, column=2, sticky=tk.E, padx=10, pady=5)
-        self.threshold_spinbox = ttk.Spinbox(self.ollama_frame, from_=1, to=10, textvariable=self.threshold_var, width=10)
-        self.threshold_spinbox.grid(row=2, column=3, sticky=tk.W, padx=10, pady=5)
-        self.log_text = scrolledtext.ScrolledText(output_frame, wrap=tk.WORD, state='disabled')
-        self.log_text.grid(row=0, column=0, sticky="nsew")
-        action_frame = ttk.Frame(bottom_frame)
-        action_frame.pack(fill=tk.X, expand=True, pady=(0,5))
-        action_frame.columnconfigure(0, weight=1)
-        self.progress_bar = ttk.Progressbar(action_frame, orient='horizontal', mode='determinate')
-        self.progress_bar.grid(row=0, column=0, sticky="ew", padx=(0, 10))
-        buttons_frame = ttk.Frame(action_frame)
-        buttons_frame.grid(row=0, column=1, sticky="e")
-        self.start_button = ttk.Button(buttons_frame, text="Start Scan", command=self.start_scan_thread)
-        self.start_button.pack(side=tk.LEFT, padx=(0, 5))
-        self.stop_button = ttk.Button(buttons_frame, text="Stop", command=self.stop_scan, state="disabled")
-        self.stop_button.pack(side=tk.LEFT)
-        ttk.Separator(bottom_frame, orient='horizontal').pack(fill=tk.X, pady=10)
-        credits_frame = ttk.Frame(bottom_frame)
-        credits_frame.pack(fill=tk.X, expand=True)
-        donation_frame = ttk.Frame(credits_frame)
-        donation_frame.pack(side=tk.RIGHT)
-        about_and_credits_frame = ttk.Frame(credits_frame)
-        about_and_credits_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        about_button = ttk.Button(about_and_credits_frame, text="About", command=self.show_about_window, width=8)
-        about_button.pack(side=tk.LEFT, padx=(0, 10))
-        ttk.Label(about_and_credits_frame, text="Created By Pavel RST | Pavrst@proton.me").pack(side=tk.LEFT, padx=5)
-        ttk.Label(donation_frame, text="Donate:").pack(side=tk.LEFT, padx=(10, 5))
-        self.kofi_link = "https://ko-fi.com/pavelrst"
-        link_font = font.Font(family="Segoe UI", size=9, underline=True)
-        kofi_label = tk.Label(donation_frame, text=self.kofi_link, fg="#007bff", cursor="hand2", font=link_font)
-        kofi_label.pack(side=tk.LEFT)
-        kofi_label.bind("<Button-1>", self.open_link)
-        ttk.Label(donation_frame, text=" | BTC:").pack(side=tk.LEFT, padx=(10, 5))
-        self.btc_address = "BC1QM2E6SE7FUE4WEPMXU2ASM47AS59WVX4WL6WRXW"
-        btc_entry = ttk.Entry(donation_frame, width=30)
-        btc_entry.insert(0, self.btc_address)
-        btc_entry.config(state="readonly")
-        btc_entry.pack(side=tk.LEFT)
-        self.copy_button = ttk.Button(donation_frame, text="Copy", command=self.copy_btc_address, width=5)
-        self.copy_button.pack(side=tk.LEFT, padx=5)
-        self.toggle_ollama_options()
-        self.update_ollama_options_state()
-
-    # --- METHODS ---
-    def open_link(self, event):
-        webbrowser.open_new(self.kofi_link)
-    def copy_btc_address(self):
-        self.clipboard_clear()
-        self.clipboard_append(self.btc_address)
-        self.log_message("BTC address copied to clipboard!")
-        original_text = self.copy_button.cget("text")
-        self.copy_button.config(text="Copied!")
-        self.after(2000, lambda: self.copy_button.config(text=original_text))
-    def show_about_window(self):
-        about_win = tk.Toplevel(self)
-        about_win.title("About AI Image Scanner")
-        about_win.geometry("650x500")
-        about_win.transient(self)
-        about_win.grab_set()
-        frame = ttk.Frame(about_win, padding="15")
-        frame.pack(fill=tk.BOTH, expand=True)
-        text_area = scrolledtext.ScrolledText(frame, wrap=tk.WORD, state='normal', relief=tk.FLAT, padx=5)
-        text_area.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
-        about_text = """
-About AI Image Scanner
---------------------------------------------------------------------------------
-This tool is designed to automate the tedious process of sorting through large photo collections to find specific subjects. It leverages the power of modern multimodal AI models to "look" at each image and determine if it matches a keyword you provide.
-How It Works
---------------------------------------------------------------------------------
-1.  You select a directory containing your images and provide a keyword (e.g., "bird", "car", "sunset").
-2.  The tool scans the directory (and its subdirectories, if enabled) for all supported image files.
-3.  For each image, it sends the image data to a selected AI model with a simple question: "Does this image prominently feature a 'keyword'?".
-4.  If the AI model confidently answers "yes", the image is marked as a match.
-5.  After the scan, all matched images are listed, and you have the option to automatically copy them to a new, organized folder.
-Key Features
---------------------------------------------------------------------------------
-- Multiple AI Providers: Choose between using a completely private and free local AI model via Ollama, or powerful cloud-based models from Google, OpenAI (ChatGPT), and DeepSeek for maximum accuracy.
-- Advanced Local AI Control: When using Ollama, you can fine-tune the AI's behavior, including its "creativity" (temperature) and the confidence threshold required for a match.
-- Recursive Scanning: Can search through complex folder structures, not just a single directory.
-- Broad Format Support: Analyzes standard formats like JPG and PNG, as well as professional formats like TIFF, CR2, and DNG.
-- User-Friendly Interface: All the power of this technology is accessible through a simple graphical interface, with no command-line knowledge required.
-"""
-        header_font = font.Font(family="Segoe UI", size=12, weight="bold")
-        text_area.tag_configure("header", font=header_font, spacing1=5, spacing3=10)
-        lines = about_text.strip().split('\n')
-        for line in lines:
-            if line.startswith('About AI Image Scanner') or line.startswith('How It Works') or line.startswith('Key Features'):
-                text_area.insert(tk.END, line + '\n', "header")
-            else:
-                text_area.insert(tk.END, line + '\n')
-        text_area.config(state='disabled')
-        close_button = ttk.Button(frame, text="Close", command=about_win.destroy)
-        close_button.pack(pady=10)
-    def show_local_ai_instructions(self):
-        instructions_win = tk.Toplevel(self)
-        instructions_win.title("Local AI (Ollama) Setup Instructions")
-        instructions_win.geometry("800x650")
-        instructions_win.transient(self)
-        instructions_win.grab_set()
-        frame = ttk.Frame(instructions_win, padding="15")
-        frame.pack(fill=tk.BOTH, expand=True)
-        text_area = scrolledtext.ScrolledText(frame, wrap=tk.WORD, state='normal', relief=tk.FLAT, padx=5)
-        text_area.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
-        instructions_text = """
-Local AI (Ollama) Setup Guide
-This guide will help you set up a local, private, and free AI model on your computer to use with this tool.
---------------------------------------------------------------------------------
-Step 1: Download and Install Ollama
---------------------------------------------------------------------------------
-1. Go to the official Ollama website: https://ollama.com
-2. Download the installer for your operating system (Windows, macOS, or Linux).
-3. Run the installer and follow the on-screen instructions.
-After installation, Ollama will run in the background.
---------------------------------------------------------------------------------
-Step 2: Download a Vision Model
---------------------------------------------------------------------------------
-You need a multimodal (vision) model to analyze images. LLaVA is a great choice.
-1. Open a Terminal (on macOS/Linux) or Command Prompt (on Windows).
-2. Type the following command and press Enter:
-   ollama run llava
-3. This will start a large download. Once finished, you can close the terminal.
-You can also download other compatible vision models, for example:
-   ollama run bakllava
-   ollama run moondream
---------------------------------------------------------------------------------
-Step 3: You're Ready!
---------------------------------------------------------------------------------
-As long as the Ollama application is running, this scanner can use it.
-- Select "ollama" as the provider in the main window.
-- Enter the model name you downloaded (e.g., "llava") in the Model field.
-- You do not need an API Key for Ollama.
---------------------------------------------------------------------------------
-Step 4: Understanding the Ollama Options
---------------------------------------------------------------------------------
-These settings give you fine-grained control over the AI's behavior.
-Model:
-The name of the model you downloaded with the `ollama run` command. You can have multiple models installed and switch between them here.
-Temperature:
-Think of this as a "creativity knob".
-- Low value (e.g., 0.1): The AI will be very strict, factual, and repetitive. Perfect for "yes/no" questions.
-- High value (e.g., 0.8): The AI will be more creative and "talkative".
-For this tool, it's best to keep the temperature low (0.1 - 0.2) for accurate results.
-Analysis Mode:
-This changes the fundamental question asked to the AI.
-- confidence: Asks the AI "How sure are you (1-10)?". This gives you more control to filter out uncertain results.
-- yesno: Asks the AI "Is it there, yes or no?". This is faster and more direct.
-Threshold (for 'confidence' mode):
-The minimum confidence score (from 1 to 10) for an image to be considered a match. A threshold of 8 means you only want images the model is very sure about.
-Prompt Mode (for 'yesno' mode):
-Changes the strategy used to ask the "yes/no" question.
-- simple: A direct, straightforward question. Faster and usually good enough.
-- cot (Chain of Thought): Tells the model to "think step-by-step" before answering. This can sometimes be more accurate but is slightly slower.
-"""
-        bold_font = font.Font(family="Segoe UI", size=10, weight="bold")
-        header_font = font.Font(family="Segoe UI", size=12, weight="bold")
-        text_area.tag_configure("bold", font=bold_font)
-        text_area.tag_configure("header", font=header_font, spacing1=5, spacing3=10)
-        text_area.tag_configure("link", foreground="#007bff", underline=True)
-        text_area.tag_configure("option_header", font=bold_font, spacing1=8, spacing3=2)
-        lines = instructions_text.strip().split('\n')
-        for line in lines:
-            if line.startswith('Step'):
-                text_area.insert(tk.END, line + '\n', "header")
-            elif line.startswith('   ollama run'):
-                text_area.insert(tk.END, line + '\n', "bold")
-            elif 'https://ollama.com' in line:
-                start_index = text_area.index(tk.END + f"-{len(line)+1}c")
-                text_area.insert(tk.END, line + '\n')
-                end_index = text_area.index(tk.END + "-1c")
-                text_area.tag_add("link", start_index, end_index)
-            elif line.strip().endswith(':'):
-                text_area.insert(tk.END, line + '\n', "option_header")
-            else:
-                text_area.insert(tk.END, line + '\n')
-        text_area.config(state='disabled')
-        close_button = ttk.Button(frame, text="Close", command=instructions_win.destroy)
-        close_button.pack(pady=10)
-    def select_dir(self):
-        path = filedialog.askdirectory(title="Select Image Directory")
-        if path: self.dir_var.set(path)
-    def select_destination_dir(self):
-        path = filedialog.askdirectory(title="Select Destination Directory")
-        if path: self.destination_dir_var.set(path)
-    def toggle_ollama_options(self, event=None):
-        is_ollama = self.provider_var.get() == 'ollama'
-        state = 'normal' if is_ollama else 'disabled'
-        for widget in self.ollama_frame.winfo_children():
-            widget.configure(state=state)
-        api_state = 'disabled' if is_ollama else 'normal'
-        self.api_key_label.config(state=api_state)
-        self.api_key_entry.config(state=api_state)
-        self.update_ollama_options_state()
-    def update_ollama_options_state(self, event=None):
-        if self.provider_var.get() != 'ollama':
-            is_yesno = False
-        else:
-            is_yesno = self.mode_var.get() == 'yesno'
-        self.prompt_mode_label.config(state='normal' if is_yesno else 'disabled')
-        prompt_combo_state = 'readonly' if is_yesno and self.provider_var.get() == 'ollama' else 'disabled'
-        self.prompt_mode_combo.config(state=prompt_combo_state)
-        self.threshold_label.config(state='disabled' if is_yesno else 'normal')
-        threshold_spin_state = 'normal' if not is_yesno and self.provider_var.get() == 'ollama' else 'disabled'
-        self.threshold_spinbox.config(state=threshold_spin_state)
-    def log_message(self, message):
-        self.log_text.configure(state='normal')
-        self.log_text.insert(tk.END, message + '\n')
-        self.log_text.configure(state='disabled')
-        self.log_text.see(tk.END)
-    def update_progress(self, value):
-        self.progress_bar['value'] = value
-    def stop_scan(self):
-        self.log_message("Stop signal received. Finishing current image analysis...")
-        self.stop_event.set()
-        self.stop_button.config(state="disabled")
-    def start_scan_thread(self):
-        params = {
-            'directory': self.dir_var.get(), 'focus_keyword': self.focus_var.get(),
-            'destination_folder': self.destination_dir_var.get() or None,
-            'action': self.action_var.get(),
-            'recursive': self.recursive_var.get(),
-            'provider': self.provider_var.get(),
-            'api_key': self.api_key_var.get(), 'debug_mode': self.debug_var.get(),
-            'model_name': self.model_var.get(), 'mode': self.mode_var.get(),
-            'prompt_mode': self.prompt_mode_var.get(), 'threshold': self.threshold_var.get(),
-            'temperature': self.temp_var.get(),
-        }
-        if not params['directory'] or not params['focus_keyword']:
-            self.log_message("Error: Please provide an image directory and a keyword.")
-            return
-        if params['provider'] != 'ollama' and not params['api_key']:
-             self.log_message(f"Error: API Key is required for provider '{params['provider']}'.")
-             return
-        self.start_button.config(state='disabled')
-        self.stop_button.config(state='normal')
-        self.stop_event.clear()
-        self.progress_bar['value'] = 0
-        self.log_text.configure(state='normal')
-        self.log_text.delete('1.0', tk.END)
-        self.log_text.configure(state='disabled')
-        scan_thread = threading.Thread(target=self.run_scan_logic, args=(params,), daemon=True)
-        scan_thread.start()
-    def run_scan_logic(self, params):
+# --- Headless command-line / library entry point (no Tk import on this path) ---
+def scan(params, log_callback=None, progress_callback=None, stop_event=None, result_callback=None):
+    return find_images_logic(params, progress_callback or (lambda value: None), log_callback or (lambda message: None), stop_event or threading.Event(), result_callback)
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="AiImageScanner", description="Find images whose main subject matches a keyword. Run without arguments to open the GUI.")
+    parser.add_argument("directories", nargs='+', metavar="directory", help="Image directories to scan.")
+    parser.add_argument("-k", "--keyword", action="append", default=[], dest="focus_keywords", help="Subject to look for, e.g. 'bird'. Repeat it or separate with commas to sort by several keywords in one pass.")
+    parser.add_argument("-p", "--provider", default="ollama", choices=['ollama', 'google', 'chatgpt', 'deepseek'])
+    parser.add_argument("--api-key", default=None, help="API key for the cloud provider (defaults to GEMINI_API_KEY, OPENAI_API_KEY or DEEPSEEK_API_KEY, matching --provider or --cascade).")
+    parser.add_argument("--model", dest="model_name", default="llava", help="Ollama model name.")
+    parser.add_argument("--mode", default="confidence", choices=['confidence', 'yesno'])
+    parser.add_argument("--prompt-mode", default="simple", choices=['simple', 'cot'])
+    parser.add_argument("--threshold", type=int, default=8)
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--cascade", dest="cascade_provider", default=None, choices=['google', 'chatgpt', 'deepseek'], help="Ask Ollama first and send only uncertain images to this cloud provider.")
+    parser.add_argument("--cascade-accept", type=int, default=None, help="Ollama scores at or above this are matches (default: --threshold).")
+    parser.add_argument("--cascade-reject", type=int, default=3, help="Ollama scores at or below this are rejected without asking the cloud.")
+    parser.add_argument("--cloud-cost", dest="cloud_cost_per_image", type=float, default=None, help="Price of one cloud request in USD, for the savings estimate.")
+    parser.add_argument("--destination", dest="destination_folder", default=None, help="Copy or move matches to this folder.")
+    parser.add_argument("--action", default="copy", choices=OUTPUT_ACTIONS, help="How matches reach the destination; hardlink/reflink fall back to copying when the filesystem cannot share data.")
+    parser.add_argument("--output-layout", default="flat", choices=['flat', 'mirror'], help="'mirror' recreates the source folder structure in the destination.")
+    parser.add_argument("--output-workers", type=int, default=4)
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false")
+    parser.add_argument("--cache-path", default=None)
+    parser.add_argument("--no-preprocess", dest="preprocess", action="store_false")
+    parser.add_argument("--max-edge", type=int, default=1536)
+    parser.add_argument("--upload-quality", type=int, default=85)
+    parser.add_argument("--upload-format", default="jpeg", choices=['jpeg', 'webp'])
+    parser.add_argument("--dedupe", action="store_true", help="Classify one representative per group of near-duplicate photos.")
+    parser.add_argument("--dedupe-distance", type=int, default=5, help="Maximum dHash Hamming distance for near-duplicates.")
+    parser.add_argument("--scan-workers", type=int, default=8, help="Threads used to list directories.")
+    parser.add_argument("--manifest", dest="use_manifest", action="store_true", help="Remember directory listings so unchanged directories are not re-listed.")
+    parser.add_argument("--manifest-path", default=None)
+    parser.add_argument("--delta", dest="delta_only", action="store_true", help="Only analyze images added or modified since the last completed scan with the same keywords and provider (implies --manifest).")
+    parser.add_argument("--verify-files", action="store_true", help="With --manifest, also stat every file in unchanged directories to catch images rewritten in place (slower on network shares).")
+    parser.add_argument("--watch", action="store_true", help="Keep running and classify images as they arrive; matches are sorted immediately.")
+    parser.add_argument("--watch-existing", action="store_true", help="In watch mode, also classify the images already present (by default only those that arrived since the last watch of the folder).")
+    parser.add_argument("--settle-seconds", type=float, default=2.0, help="How long a new file must stay unchanged before it is classified.")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Rescan interval when inotify is unavailable.")
+    parser.add_argument("--no-inotify", dest="use_inotify", action="store_false", help="Always poll instead of using inotify.")
+    parser.add_argument("--build-index", dest="index_action", action="store_const", const="build", help="Caption and embed every image once into the offline index instead of scanning for a keyword.")
+    parser.add_argument("--from-index", dest="index_action", action="store_const", const="query", help="Answer the keyword query from the offline index without sending images to the model.")
+    parser.add_argument("--index-dir", default=None)
+    parser.add_argument("--embed-model", default="nomic-embed-text", help="Ollama embedding model for captions; an empty value indexes captions only.")
+    parser.add_argument("--query-mode", default="auto", choices=['auto', 'caption'])
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--min-score", type=float, default=0.0, help="Minimum cosine similarity for index hits.")
+    parser.add_argument("--verify", action="store_true", help="Re-check the index hits with the model before reporting them.")
+    parser.add_argument("--ollama-host", dest="ollama_hosts", action="append", default=None, metavar="URL[=N]", help="Ollama endpoint to use; repeat to spread the scan over several machines. '=N' sets that host's concurrency.")
+    parser.add_argument("--host-concurrency", type=int, default=4, help="Concurrent requests per Ollama endpoint.")
+    parser.add_argument("--hedge-after", type=float, default=None, metavar="SECONDS", help="Re-send a request to another endpoint when it has not answered after this long.")
+    parser.add_argument("--health-interval", type=float, default=15.0, help="Seconds between Ollama endpoint health checks.")
+    parser.add_argument("--api-base-url", help="Send cloud requests to this scheme://host instead, e.g. a proxy or a local stand-in server.")
+    parser.add_argument("--metrics-json", dest="metrics_path", help="Write per-stage timing percentiles, status codes, retries and uploaded bytes as JSON.")
+    parser.add_argument("--prometheus-file", dest="prometheus_path", help="Write the same metrics in Prometheus text format (e.g. for the node_exporter textfile collector).")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="How often --watch rewrites the metric files, in seconds.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Images packed into one cloud request (Google, ChatGPT, DeepSeek); unreadable answers are retried one image at a time.")
+    parser.add_argument("--engine", default="threads", choices=['threads', 'asyncio'])
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--io-workers", type=int, default=2)
+    parser.add_argument("--async-concurrency", type=int, default=64)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    parser.add_argument("--tokens-per-minute", type=int, default=None)
+    parser.add_argument("--no-stream", dest="ollama_stream", action="store_false", help="Disable streaming Ollama responses.")
+    parser.add_argument("--keep-alive", default="30m", help="How long Ollama keeps the model loaded.")
+    parser.add_argument("--no-partial-output", dest="process_partial_results", action="store_false", help="Do not copy/move matches found before a scan was interrupted.")
+    parser.add_argument("-o", "--output", default="-", help="JSON Lines result file ('-' for stdout).")
+    parser.add_argument("--all", dest="emit_all", action="store_true", help="Also emit non-matching images.")
+    parser.add_argument("--log-file", default=None, help="Write the scan log to this file instead of stderr.")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Do not print the scan log.")
+    parser.add_argument("--debug", dest="debug_mode", action="store_true")
+    return parser
+API_KEY_ENV = {'google': "GEMINI_API_KEY", 'chatgpt': "OPENAI_API_KEY", 'deepseek': "DEEPSEEK_API_KEY"}
+def params_from_args(args):
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'emit_all', 'log_file', 'quiet') and value is not None}
+    params['directory'] = args.directories[0]
+    params['focus_keywords'] = [keyword.strip() for value in args.focus_keywords for keyword in value.split(',') if keyword.strip()]
+    params['focus_keyword'] = params['focus_keywords'][0] if params['focus_keywords'] else ''
+    key_env = API_KEY_ENV.get(args.cascade_provider or args.provider)
+    params['api_key'] = args.api_key or (os.getenv(key_env, "") if key_env else "")
+    return params
+def run_cli(argv):
+    args = build_arg_parser().parse_args(argv)
+    params = params_from_args(args)
+    if (params['provider'] != 'ollama' or params.get('cascade_provider')) and not params['api_key']:
+        print(f"Error: API Key is required for provider '{params.get('cascade_provider') or params['provider']}'.", file=sys.stderr)
+        return 2
+    if params.get('engine') == 'asyncio' and params['provider'] == 'ollama' and (len(params.get('ollama_hosts') or []) > 1 or params.get('hedge_after') is not None):
+        print("Error: Several --ollama-host endpoints and --hedge-after need the thread engine; drop --engine asyncio.", file=sys.stderr)
+        return 2
+    if not params['focus_keywords'] and params.get('index_action') != 'build':
+        print("Error: Please provide at least one keyword.", file=sys.stderr)
+        return 2
+    for directory in params['directories']:
+        if not os.path.isdir(directory):
+            print(f"Error: '{directory}' is not a directory.", file=sys.stderr)
+            return 2
+    output = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    log_file = open(args.log_file, 'a', encoding='utf-8') if args.log_file else None
+    write_lock = threading.Lock()
+    errors = []
+    def log_callback(message):
+        if args.quiet: return
+        with write_lock:
+            print(message, file=log_file or sys.stderr, flush=True)
+    def result_callback(image_path, status, keywords):
+        if status in ('failed', 'error', 'stopped'): errors.append(image_path)
+        if status == 'no_match' and not args.emit_all: return
+        record = {"path": image_path, "status": status, "keywords": keywords}
+        with write_lock:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+    stop_event = threading.Event()
+    outcome = {}
+    def worker():
         try:
-            find_images_logic(params, self.update_progress, self.log_message, self.stop_event)
+            run = {'build': build_image_index, 'query': search_image_index}.get(params.get('index_action'), find_images_logic)
+            outcome['found'] = run(params, lambda value: None, log_callback, stop_event, result_callback)
         except Exception as e:
-            self.log_message(f"A critical error occurred: {e}")
-        finally:
-            self.start_button.config(state='normal')
-            self.stop_button.config(state='disabled')
+            outcome['error'] = e
+    scan_thread = threading.Thread(target=worker, daemon=True)
+    scan_thread.start()
+    try:
+        while scan_thread.is_alive(): scan_thread.join(0.5)
+    except KeyboardInterrupt:
+        log_callback("Interrupted, stopping scan...")
+        stop_event.set()
+        scan_thread.join()
+        return 130
+    finally:
+        if output is not sys.stdout: output.close()
+        if log_file: log_file.close()
+    if 'error' in outcome:
+        print(f"A critical error occurred: {outcome['error']}", file=sys.stderr)
+        return 1
+    return 1 if errors else 0
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv: return run_cli(argv)
+    # Running as a script makes this module __main__; register it so the GUI's import reuses it.
+    sys.modules.setdefault('AiImageScanner', sys.modules[__name__])
+    from AiImageScannerGui import App
+    App().mainloop()
+    return 0
 
 if __name__ == "__main__":
-    app = App()
-    app.mainloop()
\ No newline at end of file
+    sys.exit(main())
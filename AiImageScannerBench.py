@@ -0,0 +1,404 @@
+import os
+import sys
+import json
+import math
+import random
+import re
+import time
+import zlib
+import argparse
+import itertools
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Throughput benchmark for find_images_logic: local stand-ins for the Ollama, OpenAI and Gemini endpoints,
+# synthetic image trees, and one subprocess per configuration so peak RSS is measured per run.
+BENCH_KEYWORD = "cat"
+IMAGE_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'tiff': 'TIFF'}
+RESPONSE_SHAPES = ('clean', 'verbose', 'malformed', 'partial')
+
+# --- Latency models: "fixed:80", "uniform:20-200", "lognormal:80,0.5" (median ms, sigma) ---
+def parse_latency(spec):
+    kind, _, value = spec.partition(':')
+    try:
+        if kind == 'fixed':
+            seconds = float(value) / 1000
+            return lambda rng: seconds
+        if kind == 'uniform':
+            low, high = (float(part) / 1000 for part in value.split('-'))
+            return lambda rng: rng.uniform(low, high)
+        if kind == 'lognormal':
+            median, sigma = (float(part) for part in value.split(','))
+            return lambda rng: rng.lognormvariate(math.log(median / 1000), sigma)
+    except ValueError:
+        pass
+    raise ValueError(f"Bad latency spec '{spec}', expected fixed:MS, uniform:MIN-MAX or lognormal:MEDIAN,SIGMA.")
+def parse_latencies(specs):
+    # A bare spec applies to every provider; "ollama=..." overrides one of them.
+    latencies = {}
+    for spec in specs or ['fixed:0']:
+        provider, _, model = spec.rpartition('=')
+        for name in ([provider] if provider else ['ollama', 'openai', 'gemini']): latencies[name] = parse_latency(model)
+    return latencies
+
+# --- Response shapes: "clean", or "verbose", "malformed", "partial" with an optional share, e.g. "partial:0.2" ---
+def parse_shape(spec):
+    name, _, share = spec.partition(':')
+    if name not in RESPONSE_SHAPES: raise ValueError(f"Unknown response shape '{name}', choose from {', '.join(RESPONSE_SHAPES)}.")
+    try:
+        return name, float(share or 1)
+    except ValueError:
+        raise ValueError(f"Bad response shape '{spec}', expected NAME or NAME:SHARE.")
+
+# --- Mock provider servers ---
+class MockConfig:
+    def __init__(self, latencies, match_rate=0.3, error_rate=0.0, throttle_rate=0.0, retry_after=1, token_ms=0.0, seed=0, shape=('clean', 1.0)):
+        self.latencies = latencies
+        self.shape = shape
+        self.match_rate = match_rate
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.token_ms = token_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+    def reset(self):
+        with self.lock: self.stats = {'requests': 0, 'bytes_received': 0, 'images': 0, 'status': {}}
+    def count(self, status, received, images):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += received
+            self.stats['images'] += images
+            self.stats['status'][str(status)] = self.stats['status'].get(str(status), 0) + 1
+    def draw(self, provider):
+        with self.lock:
+            delay = self.latencies.get(provider, self.latencies.get('ollama'))(self.rng)
+            roll = self.rng.random()
+        if roll < self.throttle_rate: return delay, 429
+        if roll < self.throttle_rate + self.error_rate: return delay, 500
+        return delay, 200
+def _keywords(prompt):
+    listed = re.search(r"these subjects: (.*?), (?:rate|decide)", prompt)
+    return re.findall(r"'([^']+)'", listed.group(1)) if listed else None
+def mock_answer(prompt, images, config):
+    # Verdicts depend only on the request content, so every configuration sees the same matches.
+    def matched(*salt): return (zlib.crc32(repr((images, salt)).encode()) % 10000) / 10000 < config.match_rate
+    keywords = _keywords(prompt)
+    if 'maps every image number' in prompt:
+        return json.dumps({str(number): ({keyword: matched(number, keyword) for keyword in keywords} if keywords else ("yes" if matched(number) else "no")) for number in range(1, len(images) + 1)})
+    if keywords:
+        scored = 'rate from 1 to 10' in prompt
+        return json.dumps({keyword: (9 if matched(keyword) else 2) if scored else matched(keyword) for keyword in keywords})
+    if prompt.startswith('On a scale of 1 to 10'): return "9" if matched() else "2"
+    if 'describe the image in one sentence' in prompt: return "The image shows a synthetic test pattern.\n" + ("yes" if matched() else "no")
+    return "yes" if matched() else "no"
+def shape_answer(answer, prompt, images, config):
+    # Real models pad, truncate or drop parts of their answers; this exercises the parse-error and fallback paths.
+    name, share = config.shape
+    if name == 'clean' or not answer: return answer
+    if (zlib.crc32(repr((images, prompt, 'shape')).encode()) % 10000) / 10000 >= share: return answer
+    structured = answer.lstrip().startswith('{')
+    if name == 'verbose': return f"Sure, I looked at the image carefully.\n{answer}\nI hope this helps."
+    if name == 'malformed': return answer[:len(answer) // 2] if structured else "<|im_end|>"
+    if not structured: return ""
+    # 'partial': the last image of a batch, or the last keyword, is missing from the answer.
+    answers = json.loads(answer)
+    answers.pop(list(answers)[-1], None)
+    return json.dumps(answers)
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+    def log_message(self, *args):
+        pass
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size: break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            self.rfile.readline()
+            return bytes(body)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items(): self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def do_GET(self):
+        body = b"Ollama is running"
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def do_POST(self):
+        raw = self._read_body()
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            request = {}
+        # Images are identified by their last base64 characters, which is enough to tell synthetic files apart.
+        if self.path == '/api/generate': provider, prompt, images = 'ollama', request.get('prompt', ''), request.get('images') or []
+        elif self.path == '/api/embed': provider, prompt, images = 'ollama', None, []
+        elif self.path.startswith('/v1/chat/completions'):
+            content = request['messages'][0]['content']
+            provider, prompt, images = 'openai', content[0]['text'], [part['image_url']['url'] for part in content if part.get('type') == 'image_url']
+        elif ':generateContent' in self.path:
+            parts = request['contents'][0]['parts']
+            provider, prompt, images = 'gemini', parts[0]['text'], [part['inlineData']['data'] for part in parts if 'inlineData' in part]
+        else:
+            self.config.count(404, len(raw), 0)
+            return self._send(404, {"error": "not found"})
+        images = [image[-64:] for image in images]
+        delay, status = self.config.draw(provider)
+        if prompt is not None and not images: delay, status = 0.0, 200
+        time.sleep(delay)
+        self.config.count(status, len(raw), len(images))
+        if status == 429: return self._send(429, {"error": "rate limited"}, {'Retry-After': str(self.config.retry_after)})
+        if status != 200: return self._send(status, {"error": "injected failure"})
+        if prompt is None: return self._send(200, {"embeddings": [[random.random() for _ in range(64)]]})
+        answer = shape_answer(mock_answer(prompt, images, self.config), prompt, images, self.config) if images else ""
+        if provider == 'openai': return self._send(200, {"choices": [{"message": {"content": answer}}], "usage": {"prompt_tokens": 85 + 255 * len(images), "completion_tokens": max(1, len(answer) // 4)}})
+        if provider == 'gemini': return self._send(200, {"candidates": [{"content": {"parts": [{"text": answer}]}}], "usageMetadata": {"promptTokenCount": 60 + 258 * len(images), "candidatesTokenCount": max(1, len(answer) // 4)}})
+        if not request.get('stream'): return self._send(200, {"model": request.get('model'), "response": answer, "done": True})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for start in range(0, len(answer), 4):
+                self._write_chunk({"response": answer[start:start + 4], "done": False})
+                if self.config.token_ms: time.sleep(self.config.token_ms / 1000)
+            self._write_chunk({"response": "", "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+    def _write_chunk(self, payload):
+        line = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+def start_mock_server(config, port=0):
+    handler = type('BoundMockHandler', (MockHandler,), {'config': config})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- Synthetic image trees ---
+def parse_format_mix(spec):
+    mix = {}
+    for entry in spec.split(','):
+        name, _, weight = entry.strip().lower().partition(':')
+        if name not in IMAGE_FORMATS: raise ValueError(f"Unknown image format '{name}', choose from {', '.join(IMAGE_FORMATS)}.")
+        mix[name] = float(weight or 1)
+    return mix
+def generate_image_tree(root, count, format_mix, size=(1600, 1200), per_folder=200, seed=0, log_callback=print):
+    spec = {'count': count, 'formats': format_mix, 'size': list(size), 'per_folder': per_folder, 'seed': seed}
+    spec_path = os.path.join(root, 'tree.json')
+    try:
+        with open(spec_path, encoding='utf-8') as handle:
+            if json.load(handle) == spec: return root
+    except (OSError, ValueError):
+        pass
+    if Image is None or np is None: raise RuntimeError("Generating synthetic images needs Pillow and NumPy.")
+    log_callback(f"Generating {count} synthetic images in {root}...")
+    rng = np.random.default_rng(seed)
+    width, height = size
+    # A smooth gradient plus a unique noise patch: realistic encoder sizes, and no two files share a content hash.
+    y, x = np.mgrid[0:height, 0:width]
+    names, weights = list(format_mix), list(format_mix.values())
+    picks = random.Random(seed).choices(names, weights, k=count)
+    for index, file_format in enumerate(picks):
+        folder = os.path.join(root, *(f"d{part:03d}" for part in divmod(index // per_folder, 20)))
+        os.makedirs(folder, exist_ok=True)
+        tint = rng.integers(0, 255, 3)
+        base = ((x[..., None] * (128 / width) + y[..., None] * (96 / height) + tint * np.linspace(0.2, 0.6, 3)) * (0.8 + index % 5 * 0.05)).astype(np.uint8)
+        top, left = rng.integers(0, height - 64), rng.integers(0, width - 64)
+        base[top:top + 64, left:left + 64] = rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)
+        Image.fromarray(base).save(os.path.join(folder, f"img{index:06d}.{file_format}"), IMAGE_FORMATS[file_format], quality=90)
+    with open(spec_path, 'w', encoding='utf-8') as handle: json.dump(spec, handle)
+    return root
+
+# --- One configuration per child process ---
+def peak_rss_bytes():
+    # VmHWM starts fresh at exec; ru_maxrss on Linux would carry over the parent's peak through fork.
+    try:
+        with open('/proc/self/status', encoding='ascii') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'): return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+def run_configuration(config):
+    import AiImageScanner
+    params = config['params']
+    log_lines = []
+    stop_event = threading.Event()
+    if not config.get('measure', True):
+        AiImageScanner.find_images_logic(dict(params, metrics=False), lambda value: None, log_lines.append, stop_event)
+        return {}
+    started = time.perf_counter()
+    found = AiImageScanner.find_images_logic(params, lambda value: None, log_lines.append, stop_event)
+    wall = time.perf_counter() - started
+    with open(params['metrics_path'], encoding='utf-8') as handle: metrics = json.load(handle)
+    errors = [line for line in log_lines if line.startswith("Error")]
+    return {'wall_seconds': wall, 'found': len(found), 'metrics': metrics, 'peak_rss_bytes': peak_rss_bytes(), 'errors': errors[:20], 'warnings': sum(line.startswith("Warning") for line in log_lines)}
+def _scan_params(options, provider, workers, engine, cache, preprocess, batch_size, mock_url, scratch):
+    cache_path = os.path.join(scratch, 'verdicts.sqlite3')
+    if os.path.exists(cache_path): os.remove(cache_path)
+    return {
+        'provider': provider, 'directory': options.tree, 'directories': [options.tree], 'focus_keyword': BENCH_KEYWORD, 'focus_keywords': [BENCH_KEYWORD],
+        'api_key': 'benchmark', 'debug_mode': False, 'model_name': 'llava', 'mode': options.mode, 'threshold': 8, 'prompt_mode': 'simple', 'temperature': 0.1,
+        'max_workers': workers, 'io_workers': options.io_workers, 'engine': engine, 'use_cache': cache != 'off', 'cache_path': cache_path, 'preprocess': preprocess == 'on', 'batch_size': batch_size,
+        'ollama_stream': not options.no_stream, 'ollama_hosts': [mock_url], 'api_base_url': mock_url, 'metrics_path': os.path.join(scratch, 'metrics.json'),
+    }
+def configurations(options):
+    matrix = itertools.product(options.providers, options.workers, options.engines, options.cache, options.preprocess, options.batch_sizes)
+    for provider, workers, engine, cache, preprocess, batch_size in matrix:
+        # Packing only applies to cloud providers and runs on the thread engine.
+        if batch_size > 1 and (provider == 'ollama' or engine == 'asyncio'): continue
+        key = f"{provider} workers={workers} engine={engine} cache={cache} preprocess={preprocess} batch={batch_size}"
+        if options.shape[0] != 'clean': key += f" shape={options.shape[0]}:{options.shape[1]:g}"
+        yield key, (provider, workers, engine, cache, preprocess, batch_size)
+
+# --- Reporting ---
+def _median(values):
+    values = sorted(value for value in values if value is not None)
+    return values[len(values) // 2] if values else None
+def summarize(key, runs, server_stats):
+    totals = [run['metrics']['stages'].get('total', {}) for run in runs]
+    processed = _median([run['metrics']['images'].get('total', 0) for run in runs])
+    return {
+        'config': key, 'images': processed, 'found': _median([run['found'] for run in runs]),
+        'images_per_second': _median([run['metrics']['images'].get('total', 0) / run['wall_seconds'] for run in runs]),
+        'p50_ms': _median([total.get('p50', 0) * 1000 for total in totals]), 'p95_ms': _median([total.get('p95', 0) * 1000 for total in totals]), 'p99_ms': _median([total.get('p99', 0) * 1000 for total in totals]),
+        'peak_rss_mb': _median([run['peak_rss_bytes'] / 2 ** 20 if run['peak_rss_bytes'] else None for run in runs]),
+        'bytes_sent': _median([stats['bytes_received'] for stats in server_stats]), 'requests': _median([stats['requests'] for stats in server_stats]),
+        'status': server_stats[-1]['status'], 'warnings': runs[-1]['warnings'], 'errors': runs[-1]['errors'],
+    }
+def format_row(result, baseline=None):
+    rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else "n/a"
+    row = f"{result['config']:<72} {result['images_per_second']:>9.1f} {result['p50_ms']:>8.0f} {result['p95_ms']:>8.0f} {result['p99_ms']:>8.0f} {rss:>8} {result['bytes_sent'] / 2 ** 20:>9.1f} {result['requests']:>8}"
+    if baseline: row += f"  ({(result['images_per_second'] / baseline['images_per_second'] - 1) * 100:+.0f}% img/s, {(result['p95_ms'] / max(baseline['p95_ms'], 1e-9) - 1) * 100:+.0f}% p95)"
+    return row
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['config'])
+        if not previous: continue
+        if result['images_per_second'] < previous['images_per_second'] * (1 - tolerance): regressions.append(f"{result['config']}: throughput {previous['images_per_second']:.1f} -> {result['images_per_second']:.1f} images/s")
+        if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance): regressions.append(f"{result['config']}: p95 latency {previous['p95_ms']:.0f} -> {result['p95_ms']:.0f} ms")
+    return regressions
+
+# --- CLI ---
+def _list(kind=str):
+    return lambda value: [kind(part.strip()) for part in value.split(',') if part.strip()]
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="AiImageScannerBench", description="Measure scan throughput against local stand-in provider servers, without network access.")
+    parser.add_argument("--images", type=int, default=300, help="Size of the synthetic image tree.")
+    parser.add_argument("--formats", type=parse_format_mix, default=parse_format_mix("jpg:6,png:3,tiff:1"), help="Format mix as name:weight, e.g. jpg:6,png:3,tiff:1 (jpg, png, webp, tiff).")
+    parser.add_argument("--image-size", default="1600x1200", help="Width x height of the synthetic images.")
+    parser.add_argument("--tree", default=None, help="Directory for the synthetic tree; reused when its settings match (default: a folder under the system temp dir).")
+    parser.add_argument("--providers", type=_list(), default=['ollama'], help="Comma-separated: ollama, chatgpt, deepseek, google.")
+    parser.add_argument("--workers", type=_list(int), default=[4], help="Comma-separated worker counts, e.g. 4,8,16.")
+    parser.add_argument("--engines", type=_list(), default=['threads'], help="Comma-separated: threads, asyncio.")
+    parser.add_argument("--cache", type=_list(), default=['off'], help="Comma-separated: off, cold (empty cache), warm (cache filled by an unmeasured run).")
+    parser.add_argument("--preprocess", type=_list(), default=['on'], help="Comma-separated: on, off.")
+    parser.add_argument("--batch-sizes", type=_list(int), default=[1], help="Comma-separated images per cloud request, e.g. 1,8.")
+    parser.add_argument("--io-workers", type=int, default=2, help="Threads reading and preprocessing images.")
+    parser.add_argument("--mode", default="confidence", choices=['confidence', 'yesno'], help="Ollama analysis mode.")
+    parser.add_argument("--no-stream", action="store_true", help="Disable streaming Ollama responses.")
+    parser.add_argument("--latency", action="append", default=None, help="Model latency: fixed:MS, uniform:MIN-MAX or lognormal:MEDIAN,SIGMA. Prefix with ollama=, openai= or gemini= for one provider. Repeatable.")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="Delay between streamed Ollama chunks.")
+    parser.add_argument("--match-rate", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with HTTP 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429 responses.")
+    parser.add_argument("--shape", type=parse_shape, default=('clean', 1.0), help="Answer shape: clean, or verbose, malformed or partial with an optional share of affected answers, e.g. partial:0.2.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per configuration; medians are reported.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results as JSON (usable later as --baseline).")
+    parser.add_argument("--baseline", help="Compare against a saved result file and exit with 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed throughput drop or p95 increase before a regression is reported.")
+    parser.add_argument("--run-config", help=argparse.SUPPRESS)
+    return parser
+def run_benchmarks(options):
+    try:
+        size = tuple(int(part) for part in options.image_size.lower().split('x'))
+        latencies = parse_latencies(options.latency)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    options.tree = os.path.abspath(options.tree or os.path.join(tempfile.gettempdir(), f"aiimagescanner-bench-{options.images}-{options.seed}"))
+    os.makedirs(options.tree, exist_ok=True)
+    generate_image_tree(options.tree, options.images, options.formats, size, seed=options.seed)
+    mock = MockConfig(latencies, options.match_rate, options.error_rate, options.throttle_rate, options.retry_after, options.token_ms, options.seed, options.shape)
+    server, mock_url = start_mock_server(mock)
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline, encoding='utf-8') as handle: baseline = {result['config']: result for result in json.load(handle)['results']}
+    print(f"{'configuration':<72} {'images/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>8} {'MB sent':>9} {'requests':>8}")
+    results = []
+    script = os.path.abspath(__file__)
+    try:
+        with tempfile.TemporaryDirectory(prefix="aiimagescanner-bench-") as scratch:
+            for key, (provider, workers, engine, cache, preprocess, batch_size) in configurations(options):
+                runs, server_stats = [], []
+                for _ in range(max(1, options.repeat)):
+                    params = _scan_params(options, provider, workers, engine, cache, preprocess, batch_size, mock_url, scratch)
+                    # A warm cache is filled by an unmeasured run in its own process first.
+                    steps = [False, True] if cache == 'warm' else [True]
+                    for measure in steps:
+                        mock.reset()
+                        child = subprocess.run([sys.executable, script, '--run-config', json.dumps({'params': params, 'measure': measure})], capture_output=True, text=True)
+                        if child.returncode != 0: break
+                    if child.returncode != 0:
+                        print(f"{key:<72} failed:\n{child.stderr.strip()[-2000:]}", file=sys.stderr)
+                        break
+                    runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+                    server_stats.append(json.loads(json.dumps(mock.stats)))
+                if not runs: continue
+                result = summarize(key, runs, server_stats)
+                results.append(result)
+                print(format_row(result, baseline.get(key)), flush=True)
+                for error in result['errors'][:3]: print(f"    {error}")
+    finally:
+        server.shutdown()
+    if options.save:
+        with open(options.save, 'w', encoding='utf-8') as handle:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'arguments': sys.argv[1:], 'results': results}, handle, indent=2)
+        print(f"Results written to {options.save}.")
+    regressions = find_regressions(results, baseline, options.tolerance)
+    for regression in regressions: print(f"Regression: {regression}")
+    return 1 if regressions else 0
+def main(argv=None):
+    options = build_arg_parser().parse_args(argv)
+    if options.run_config:
+        print(json.dumps(run_configuration(json.loads(options.run_config))))
+        return 0
+    return run_benchmarks(options)
+
+if __name__ == "__main__":
+    sys.exit(main())